@@ -0,0 +1,234 @@
+"""
+The module BEAM_ATLAS precomputes the normalized AMISR-14 pattern of every beamcode listed in
+UMET_beamcodes.csv into one memory-mapped file, so that consumers read a beam's pattern with zero
+copies instead of computing it.
+
+The atlas file is a sequence of standard .npy blocks:
+
+    params  = [maxphi, nptsx, nptsy, fc, just_rx]
+    dcosx   = x-axis directional cosines (nptsx)
+    dcosy   = y-axis directional cosines (nptsy)
+    pattern = normalized patterns, float16 (nbeams, nptsy, nptsx), memory-mapped on read
+    index   = beamcode, commanded azimuth/elevation, meanpos and maxpattern per beam
+
+Patterns are stored as float16: for normalized values above 6.1e-5 (-42 dB) the relative error is at
+most 2**-11 (4.9e-4), below that the absolute error is at most 3e-8.
+
+Build from the command line (inside QT_des):
+
+    python Beam_Atlas.py UMET_atlas.npy --maxphi 33 --npts 101
+
+MODULES CALLED:
+OS, ARGPARSE, TIME, NUMPY, PLOTS, PATTERN_CACHE
+"""
+
+import os
+import time
+import argparse
+import numpy
+
+from plots import AmisrPattern
+from Pattern_Cache import CachedPattern
+
+
+atlas_dtype = numpy.dtype([('code','i8'), ('azimuth','f8'), ('elevation','f8'),
+                           ('meanpos','f8',(2,)), ('maxpattern','f8')])
+
+
+def readBeamcodes(filename):
+    """
+    readBeamcodes returns the valid rows (code, azimuth, elevation, calibration) of a beam-
+    code table such as UMET_beamcodes.csv.
+    """
+
+    pointings = numpy.genfromtxt(filename, delimiter=',')
+    return pointings[numpy.isfinite(pointings[:,0])]
+
+
+def _writeBlock(fp, array, shape=None, dtype=None):
+    if array is not None:
+        array = numpy.ascontiguousarray(array)
+        shape = array.shape
+        dtype = array.dtype
+    header = {'descr':numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)),
+              'fortran_order':False, 'shape':shape}
+    numpy.lib.format.write_array_header_2_0(fp, header)
+    if array is not None:
+        fp.write(array.tobytes())
+
+
+def buildAtlas(filename, beamfile='UMET_beamcodes.csv', maxphi=33, nptsx=101, nptsy=101,
+               fc=445, just_rx=False, verbose=True):
+    """
+    buildAtlas computes the pattern of every beamcode in BEAMFILE and writes the atlas to
+    FILENAME. Patterns are streamed to disk one beam at a time.
+
+    Parameters
+    ----------
+    filename = A string giving the output atlas file.
+    beamfile = A string giving the beamcode table. Default is UMET_beamcodes.csv.
+    maxphi, nptsx, nptsy, fc, just_rx = Pattern grid and model, as in AmisrPattern.
+
+    Return
+    ------
+    nbeams = The number of beams written.
+    """
+
+    pointings = readBeamcodes(beamfile)
+    nbeams = pointings.shape[0]
+
+    index = numpy.zeros(nbeams, dtype=atlas_dtype)
+    index['code'] = pointings[:,0]
+    index['azimuth'] = pointings[:,1]
+    index['elevation'] = pointings[:,2]
+
+    params = numpy.array([maxphi, nptsx, nptsy, fc, just_rx], dtype=float)
+
+    t0 = time.time()
+    with open(filename, 'wb') as fp:
+        ObjAnt = AmisrPattern(0, 90, maxphi=maxphi, nptsx=nptsx, nptsy=nptsy, fc=fc, just_rx=just_rx)
+        _writeBlock(fp, params)
+        _writeBlock(fp, ObjAnt.dcosx)
+        _writeBlock(fp, ObjAnt.dcosy)
+        _writeBlock(fp, None, shape=(nbeams, ObjAnt.ny, ObjAnt.nx), dtype=numpy.float16)
+
+        for ib in range(nbeams):
+            ObjAnt = AmisrPattern(index['azimuth'][ib], index['elevation'][ib], maxphi=maxphi,
+                                  nptsx=nptsx, nptsy=nptsy, fc=fc, just_rx=just_rx)
+            fp.write(ObjAnt.norpattern.astype(numpy.float16).tobytes())
+            index['meanpos'][ib] = ObjAnt.meanpos
+            index['maxpattern'][ib] = ObjAnt.maxpattern
+            if verbose and ((ib+1) % 500 == 0):
+                print("%d/%d beams (%.1f beams/s)" % (ib+1, nbeams, (ib+1)/(time.time()-t0)))
+
+        _writeBlock(fp, index)
+
+    return nbeams
+
+
+class BeamAtlas():
+
+    def __init__(self, filename):
+        """
+        BeamAtlas opens an atlas written by buildAtlas. The pattern stack is memory-mapped,
+        so only the pages of the beams actually read are loaded.
+
+        Examples
+        --------
+        >> atlas = BeamAtlas('UMET_atlas.npy')
+        >> ObjAnt = atlas.get(0xF923)
+        >> print ObjAnt.meanpos
+        """
+
+        self.filename = filename
+
+        blocks = []
+        with open(filename, 'rb') as fp:
+            for iblock in range(5):
+                version = numpy.lib.format.read_magic(fp)
+                if version == (1, 0):
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(fp)
+                else:
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(fp)
+                offset = fp.tell()
+                blocks.append((shape, dtype, offset))
+                nbytes = int(numpy.prod(shape))*dtype.itemsize
+                if iblock == 3:
+                    fp.seek(offset + nbytes)
+                else:
+                    blocks[-1] = numpy.frombuffer(fp.read(nbytes), dtype=dtype).reshape(shape)
+
+        params = blocks[0]
+        self.maxphi = params[0]
+        self.nptsx = int(params[1])
+        self.nptsy = int(params[2])
+        self.fc = params[3]
+        self.just_rx = bool(params[4])
+        self.dcosx = blocks[1]
+        self.dcosy = blocks[2]
+        self.index = blocks[4]
+
+        shape, dtype, offset = blocks[3]
+        self.patterns = numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+        self.__rows = dict(zip(self.index['code'].tolist(), range(self.index.size)))
+
+    def __len__(self):
+        return self.index.size
+
+    def __contains__(self, code):
+        return int(code) in self.__rows
+
+    def matches(self, maxphi, nptsx, nptsy, fc=445, just_rx=False):
+        """
+        matches returns True when the atlas was built with the given grid and model.
+        """
+
+        return (self.maxphi == maxphi) and (self.nptsx == nptsx) and (self.nptsy == nptsy) and \
+               (self.fc == fc) and (self.just_rx == bool(just_rx))
+
+    def row(self, code):
+        """
+        row returns the index row of a beamcode (integer or '0x...' string) or None.
+        """
+
+        if isinstance(code, str):
+            code = int(code, 16) if code.lower().startswith('0x') else int(code)
+        return self.__rows.get(int(code))
+
+    def lookup(self, azimuth, elevation, tol=1e-3):
+        """
+        lookup returns the index row of the beam commanded at (azimuth, elevation) within
+        TOL degrees, or None.
+        """
+
+        err = numpy.abs(self.index['azimuth'] - azimuth) + numpy.abs(self.index['elevation'] - elevation)
+        irow = numpy.argmin(err)
+        if err[irow] > tol:
+            return None
+        return int(irow)
+
+    def get(self, code):
+        """
+        get returns a CachedPattern for a beamcode. norpattern is a float16 view of the ma-
+        pped file (no copy); it is None if the beamcode is not in the atlas.
+        """
+
+        irow = self.row(code)
+        if irow is None:
+            return None
+        return self.__pattern(irow)
+
+    def pattern(self, azimuth, elevation, maxphi=33, nptsx=101, nptsy=101, fc=445, just_rx=False):
+        """
+        pattern returns the CachedPattern of the beam commanded at (azimuth, elevation) if
+        the atlas has it on the requested grid, otherwise None so the caller can compute it.
+        """
+
+        if not self.matches(maxphi, nptsx, nptsy, fc, just_rx):
+            return None
+        irow = self.lookup(azimuth, elevation)
+        if irow is None:
+            return None
+        return self.__pattern(irow)
+
+    def __pattern(self, irow):
+        rec = self.index[irow]
+        return CachedPattern(self.patterns[irow], rec['maxpattern'], self.dcosx, self.dcosy,
+                             rec['meanpos'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the AMISR-14 beam atlas.')
+    parser.add_argument('filename', nargs='?', default='UMET_atlas.npy')
+    parser.add_argument('--beamfile', default='UMET_beamcodes.csv')
+    parser.add_argument('--maxphi', type=float, default=33)
+    parser.add_argument('--npts', type=int, default=101)
+    parser.add_argument('--fc', type=float, default=445)
+    parser.add_argument('--just-rx', action='store_true')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    nbeams = buildAtlas(args.filename, beamfile=args.beamfile, maxphi=args.maxphi,
+                        nptsx=args.npts, nptsy=args.npts, fc=args.fc, just_rx=args.just_rx)
+    print("%d beams written to %s in %.1f s" % (nbeams, args.filename, time.time()-t0))
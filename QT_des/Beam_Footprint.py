@@ -0,0 +1,210 @@
+"""
+The module BEAM_FOOTPRINT builds the composite power footprint of an experiment's beam schedule:
+the dwell-weighted mean of the normalized single-beam patterns of the beams in sbeam,
+
+    F = TOTAL(n_i*P_i)/TOTAL(n_i)
+
+where n_i is the number of IPPs that the BCO file of GUI_genExp_AMISR points to beam i. Single-
+beam patterns are taken from a PATTERN_CACHE (and its atlas), and the weighted sum is kept up to
+date incrementally: adding or removing a beam adds or subtracts its pattern only.
+
+MODULES CALLED:
+COLLECTIONS, NUMPY, BEAM_ATLAS
+"""
+
+import collections
+import numpy
+
+from Beam_Atlas import readBeamcodes
+
+
+def scheduleWeights(sbeam, nIPPs=None, nFFT=1, beamProf=False):
+    """
+    scheduleWeights returns the dwell (number of IPPs) of every beam in a BCO schedule. As in
+    GUI_genExp_AMISR, the schedule cycles through SBEAM (each beam repeated nFFT times if
+    BEAMPROF is set) and is cut after nIPPs pulses.
+
+    Parameters
+    ----------
+    sbeam = A list of beamcodes, as integers or strings ('0xF923' or decimal).
+    nIPPs = An integer giving the number of IPPs of the schedule. If None (default  value)
+      one full cycle is used.
+    nFFT = An integer giving the number of consecutive IPPs per beam when BEAMPROF is set.
+    beamProf = Set to True to keep each beam for nFFT consecutive IPPs.
+
+    Return
+    ------
+    weights = An OrderedDict beamcode (integer) -> dwell, in order of first appearance.
+
+    Examples
+    --------
+    >> scheduleWeights(['0xF923', '0xF924', '0xF923'])
+    OrderedDict([(63779, 2), (63780, 1)])
+    """
+
+    codes = [_beamcode(code) for code in sbeam]
+    if beamProf:
+        codes = [code for code in codes for ifft in range(int(nFFT))]
+    if nIPPs is None:
+        nIPPs = len(codes)
+
+    weights = collections.OrderedDict()
+    if len(codes) == 0:
+        return weights
+
+    ncycles, nrest = divmod(int(nIPPs), len(codes))
+    for icode, code in enumerate(codes):
+        weights[code] = weights.get(code, 0) + ncycles + int(icode < nrest)
+    for code in [code for code in weights if weights[code] == 0]:
+        del weights[code]
+    return weights
+
+
+def _beamcode(code):
+    if isinstance(code, str):
+        code = code.strip()
+        code = int(code, 16) if code.lower().startswith('0x') else int(code)
+    return int(code)
+
+
+class CompositeFootprint():
+
+    def __init__(self, cache, beamfile='UMET_beamcodes.csv', maxphi=33, nptsx=101, nptsy=101,
+                 fc=445, just_rx=False):
+        """
+        CompositeFootprint creates an empty composite footprint on the grid of the cached
+        patterns (maxphi, nptsx, nptsy, as in AmisrPattern).
+
+        Parameters
+        ----------
+        cache = A Pattern_Cache.PatternCache giving the single-beam patterns.
+        beamfile = A string giving the beamcode table. Default is UMET_beamcodes.csv.
+        maxphi, nptsx, nptsy, fc, just_rx = Pattern grid and model, as in AmisrPattern.
+          The default grid is the one of the GUI map.
+
+        Examples
+        --------
+        >> footprint = CompositeFootprint(PatternCache(), beamfile='UMET_beamcodes.csv')
+        >> footprint.setSchedule(['0xF923', '0xF924'])
+        >> footprint.add('0xF925')
+        >> amp = footprint.footprint
+        """
+
+        self.cache = cache
+        self.maxphi = maxphi
+        self.nptsx = nptsx
+        self.nptsy = nptsy
+        self.fc = fc
+        self.just_rx = just_rx
+
+        pointings = readBeamcodes(beamfile)
+        self.__pointings = dict(zip(pointings[:,0].astype(int).tolist(),
+                                    zip(pointings[:,1].tolist(), pointings[:,2].tolist())))
+
+        self.dcosx = None
+        self.dcosy = None
+        self.weights = collections.OrderedDict()
+        self.__patterns = {}
+        self.__sum = None
+        self.__total = 0
+
+    def __len__(self):
+        return len(self.weights)
+
+    def add(self, code, weight=1):
+        """
+        add adds WEIGHT IPPs of a beamcode (integer or '0x...' string) to the composite.
+        """
+
+        code = _beamcode(code)
+        if weight == 0:
+            return
+        if code not in self.__patterns:
+            self.__patterns[code] = self.__getPattern(code)
+        if self.__sum is None:
+            self.__sum = numpy.zeros(self.__patterns[code].shape)
+
+        self.__sum += weight*self.__patterns[code]
+        self.__total += weight
+        self.weights[code] = self.weights.get(code, 0) + weight
+
+        if self.weights[code] == 0:
+            del self.weights[code]
+            del self.__patterns[code]
+        if self.__total == 0:
+            # Nothing left: drop the rounding residue of the updates.
+            self.__sum[:] = 0
+
+    def remove(self, code, weight=1):
+        """
+        remove subtracts WEIGHT IPPs (None for all of them) of a beamcode from the compo-
+        site. A ValueError is raised if the beamcode does not have them.
+        """
+
+        code = _beamcode(code)
+        dwell = self.weights.get(code, 0)
+        if weight is None:
+            weight = dwell
+        if weight > dwell:
+            raise ValueError("Beamcode %s has %d IPPs in the footprint, %d to remove" %
+                             (hex(code), dwell, weight))
+        self.add(code, -weight)
+
+    def setSchedule(self, sbeam, nIPPs=None, nFFT=1, beamProf=False):
+        """
+        setSchedule makes the composite match a beam schedule (see scheduleWeights). Only the
+        beams whose dwell changed are added or removed.
+
+        Return
+        ------
+        nchanged = The number of beamcodes updated.
+        """
+
+        weights = scheduleWeights(sbeam, nIPPs=nIPPs, nFFT=nFFT, beamProf=beamProf)
+        for code in weights:
+            if code not in self.__pointings:
+                raise ValueError("Beamcode not found in the beamcode table: %s" % hex(code))
+
+        nchanged = 0
+        for code in list(self.weights.keys()) + list(weights.keys()):
+            delta = weights.get(code, 0) - self.weights.get(code, 0)
+            if delta != 0:
+                self.add(code, delta)
+                nchanged += 1
+        return nchanged
+
+    def clear(self):
+        """
+        clear removes all beams from the composite.
+        """
+
+        self.weights.clear()
+        self.__patterns.clear()
+        self.__sum = None
+        self.__total = 0
+
+    @property
+    def footprint(self):
+        """
+        The dwell-weighted mean of the normalized power patterns, (nptsy, nptsx), or None
+        if the composite is empty.
+        """
+
+        if self.__total == 0:
+            return None
+        return self.__sum/self.__total
+
+    def __getPattern(self, code):
+        if code not in self.__pointings:
+            raise ValueError("Beamcode not found in the beamcode table: %s" % hex(code))
+
+        azimuth, elevation = self.__pointings[code]
+        pattern = self.cache.get(azimuth, elevation, maxphi=self.maxphi, nptsx=self.nptsx,
+                                 nptsy=self.nptsy, fc=self.fc, just_rx=self.just_rx)
+        if self.dcosx is None:
+            self.dcosx = numpy.asarray(pattern.dcosx)
+            self.dcosy = numpy.asarray(pattern.dcosy)
+
+        # Own float64 copy: subtracting exactly what was added keeps the sum consistent
+        # after the cache drops (or the atlas maps) the pattern.
+        return numpy.nan_to_num(numpy.asarray(pattern.norpattern, dtype=numpy.float64))
@@ -0,0 +1,297 @@
+"""
+The module BEAM_PLANNER selects a small set of AMISR-14 beamcodes whose footprints cover a region
+of the sky, and returns it in the form of the sbeam field of Generate_Experiments.
+
+The footprint of a beam is the ellipse where its (one-way, normalized) power is above a gain
+threshold, taken from a Gaussian model of the main beam:
+
+    semi-axis = HPBW/2*SQRT(LN(threshold)/LN(0.5)), centered on meanpos
+
+meanpos and the half-power beamwidths of every beam are read from a precomputed footprint index
+(the table of BEAM_SURVEY, or an index file built here), so that planning never evaluates a
+pattern. The region is sampled on a grid, a k-d tree of the beam centres prunes the candidate
+beams of every sample, and the beams are chosen by greedy set cover followed by removal of the
+redundant ones.
+
+The index file is a sequence of standard .npy blocks (as BEAM_ATLAS):
+
+    params = [fc]
+    digest = SHA-1 of the beamcode table the index was built from
+    index  = beamcode, commanded azimuth/elevation, meanpos and HPBW per beam
+
+An index built for another frequency or beamcode table is rebuilt.
+
+    python Beam_Planner.py --polygon="-0.2,0.1;0.2,0.1;0.2,0.3;-0.2,0.3" --threshold -3
+
+MODULES CALLED:
+OS, TIME, HASHLIB, ARGPARSE, MULTIPROCESSING, NUMPY, SCIPY, MATPLOTLIB, MISC_ROUTINES, BEAM_ATLAS,
+BEAM_SURVEY
+"""
+
+import os
+import time
+import hashlib
+import argparse
+import multiprocessing
+import numpy
+import scipy.sparse
+import scipy.spatial
+from matplotlib.path import Path
+
+import Misc_Routines
+from Beam_Atlas import readBeamcodes
+from Beam_Survey import _beamWindow, readSurvey
+
+
+footprint_dtype = numpy.dtype([('code','i8'), ('azimuth','f8'), ('elevation','f8'),
+                               ('meanpos','f8',(2,)), ('hpbw','f8',(2,))])
+
+
+def _beamfileDigest(beamfile):
+    with open(beamfile, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def _readIndex(filename, fc, digest):
+    # None if FILENAME is not an index of this frequency and beamcode table.
+    try:
+        with open(filename, 'rb') as fp:
+            params = numpy.load(fp)
+            if params.dtype.names is not None or params.size != 1 or params[0] != fc:
+                return None
+            if str(numpy.load(fp)) != digest:
+                return None
+            return numpy.load(fp)
+    except (IOError, OSError, ValueError, EOFError):
+        return None
+
+
+def _computeFootprint(args):
+    code, azimuth, elevation, fc = args
+    try:
+        Beam = _beamWindow(azimuth, elevation, fc=fc)
+        return code, Beam.meanpos, Beam.beamwidth
+    except Exception as error:
+        print("Beam %d (%.2f, %.2f) failed: %s" % (code, azimuth, elevation, error))
+        return code, None, None
+
+
+def footprintIndex(filename='UMET_footprints.npy', beamfile='UMET_beamcodes.csv', survey=None,
+                   processes=None, fc=445, verbose=True):
+    """
+    footprintIndex returns the centre and half-power beamwidths of every beamcode. The index
+    is read from FILENAME if it was built for FC and the current BEAMFILE; otherwise it is
+    taken from a BEAM_SURVEY table or, failing that, computed on a process pool, and saved
+    to FILENAME.
+
+    Parameters
+    ----------
+    filename = A string giving the index file (.npy), or None not to keep one.
+    beamfile = A string giving the beamcode table. Default is UMET_beamcodes.csv.
+    survey = A string giving a table written by Beam_Survey, or None. Only its rows com-
+      puted at FC are used.
+    processes = An integer giving the number of worker processes. Default is the number of
+      CPUs.
+    fc = A scalar giving the radar frequency in MHz. The default value is 445.
+
+    Return
+    ------
+    index = A structured array of footprint_dtype (hpbw in degrees), one row per beam.
+    """
+
+    digest = _beamfileDigest(beamfile)
+    if filename is not None and os.path.exists(filename):
+        index = _readIndex(filename, fc, digest)
+        if index is not None:
+            return index
+        if verbose:
+            print("%s was built for another fc or beamcode table, rebuilding" % filename)
+
+    pointings = readBeamcodes(beamfile)
+    footprints = {}
+
+    if survey is not None and os.path.exists(survey):
+        # Only rows computed at FC: the index is saved as valid for FC.
+        for row in readSurvey(survey, fc=fc):
+            footprints[int(row['code'])] = ([row['meanpos_x'], row['meanpos_y']],
+                                            [row['hpbw_x'], row['hpbw_y']])
+
+    jobs = [(int(row[0]), row[1], row[2], fc) for row in pointings if int(row[0]) not in footprints]
+    if verbose:
+        print("%d beams reused, %d to compute" % (len(pointings) - len(jobs), len(jobs)))
+
+    t0 = time.time()
+    if len(jobs) > 0:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for ncomp, (code, meanpos, hpbw) in enumerate(pool.imap_unordered(_computeFootprint,
+                                                                              jobs, chunksize=8)):
+                if meanpos is not None:
+                    footprints[code] = (meanpos, hpbw)
+                if verbose and ((ncomp + 1) % 500 == 0):
+                    print("%d/%d beams (%.1f beams/s)" % (ncomp + 1, len(jobs),
+                                                          (ncomp + 1)/(time.time() - t0)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    rows = [row for row in pointings if int(row[0]) in footprints]
+    index = numpy.zeros(len(rows), dtype=footprint_dtype)
+    for irow, row in enumerate(rows):
+        index[irow] = (int(row[0]), row[1], row[2]) + footprints[int(row[0])]
+
+    if filename is not None:
+        with open(filename, 'wb') as fp:
+            numpy.save(fp, numpy.array([fc], dtype=float))
+            numpy.save(fp, numpy.array(digest))
+            numpy.save(fp, index)
+    return index
+
+
+def regionSamples(polygon, space='dcos', step=None):
+    """
+    regionSamples returns the directional cosines of a regular sampling of the inside of a
+    polygon.
+
+    Parameters
+    ----------
+    polygon = An (N,2) array of vertices: (x, y) directional cosines if SPACE is 'dcos',
+      (azimuth, elevation) in degrees if SPACE is 'azel'.
+    space = 'dcos' (default value) or 'azel'. The edges are straight in this space.
+    step = A scalar giving the sampling step in the units of SPACE. The defaults are 0.005
+      (dcos) and 0.25 degrees (azel).
+
+    Return
+    ------
+    samples = An (M,2) array of (x, y) directional cosines.
+    """
+
+    polygon = numpy.asarray(polygon, dtype=float)
+    if space not in ('dcos', 'azel'):
+        raise ValueError("space must be 'dcos' or 'azel', not %r" % space)
+    if step is None:
+        step = 0.005 if space == 'dcos' else 0.25
+
+    lo = polygon.min(axis=0)
+    hi = polygon.max(axis=0)
+    nx = max(int(numpy.ceil((hi[0] - lo[0])/step)), 1)
+    ny = max(int(numpy.ceil((hi[1] - lo[1])/step)), 1)
+    # Cell centres, so that thin regions still get samples.
+    gx, gy = numpy.meshgrid(lo[0] + (numpy.arange(nx) + 0.5)*(hi[0] - lo[0])/nx,
+                            lo[1] + (numpy.arange(ny) + 0.5)*(hi[1] - lo[1])/ny)
+    points = numpy.column_stack([gx.ravel(), gy.ravel()])
+    points = points[Path(polygon).contains_points(points)]
+
+    if space == 'azel':
+        d2r = Misc_Routines.CoFactors.d2r
+        points = numpy.column_stack([numpy.cos(points[:,1]*d2r)*numpy.sin(points[:,0]*d2r),
+                                     numpy.cos(points[:,1]*d2r)*numpy.cos(points[:,0]*d2r)])
+    return points
+
+
+def planCoverage(polygon, index, threshold=-3., space='dcos', step=None, coverage=1.0):
+    """
+    planCoverage selects the beamcodes whose footprints cover a region (greedy set cover).
+
+    Parameters
+    ----------
+    polygon, space, step = The region, see regionSamples.
+    index = A footprint index, see footprintIndex.
+    threshold = A scalar giving the gain threshold (dB relative to the beam peak, one-way)
+      that defines a footprint. The default value is -3.
+    coverage = A scalar giving the fraction of the region to cover. The default value is 1.
+
+    Return
+    ------
+    plan = A dictionary with:
+      sbeam    = the chosen beamcodes as '0x...' strings, ready for Generate_Experiments
+      codes    = the chosen beamcodes as integers
+      covered  = the fraction of the region covered by the chosen beams
+      coverable = the fraction of the region covered by some beam of the index
+      nsamples = the number of region samples
+
+    Examples
+    --------
+    >> index = footprintIndex('UMET_footprints.npy', survey='UMET_survey.csv')
+    >> plan = planCoverage([[-0.2,0.1],[0.2,0.1],[0.2,0.3],[-0.2,0.3]], index, threshold=-3)
+    >> op = Parametros(Title, pps, ipp, TX, sCode, nCode, nBaud, ndh, nsa, nProfBlock,
+    >>                 nBlockFile, plan['sbeam'], file, user)
+    """
+
+    if threshold >= 0:
+        raise ValueError("threshold must be negative (dB relative to the beam peak)")
+
+    d2r = Misc_Routines.CoFactors.d2r
+    samples = regionSamples(polygon, space=space, step=step)
+    nsamples = samples.shape[0]
+    plan = {'sbeam':[], 'codes':[], 'covered':0., 'coverable':0., 'nsamples':nsamples}
+    if nsamples == 0:
+        return plan
+
+    scale = numpy.sqrt(numpy.log(10**(threshold/10.))/numpy.log(0.5))
+    semi = 0.5*index['hpbw']*d2r*scale
+    centres = index['meanpos']
+
+    # Candidates within the largest semi-axis, then the exact ellipse test.
+    tree = scipy.spatial.cKDTree(centres)
+    near = tree.query_ball_point(samples, r=numpy.max(semi))
+    isample = numpy.repeat(numpy.arange(nsamples), [len(beams) for beams in near])
+    ibeam = numpy.fromiter((ib for beams in near for ib in beams), dtype=int, count=isample.size)
+    inside = ((samples[isample,0] - centres[ibeam,0])/semi[ibeam,0])**2 + \
+             ((samples[isample,1] - centres[ibeam,1])/semi[ibeam,1])**2 <= 1
+    cover = scipy.sparse.csr_matrix((numpy.ones(numpy.count_nonzero(inside)),
+                                     (ibeam[inside], isample[inside])),
+                                    shape=(len(index), nsamples))
+
+    coverable = numpy.asarray(cover.sum(axis=0)).ravel() > 0
+    target = min(coverage, 1.0)*numpy.count_nonzero(coverable)
+    uncovered = coverable.astype(float)
+    chosen = []
+    while numpy.count_nonzero(coverable) - numpy.sum(uncovered) < target:
+        gain = cover.dot(uncovered)
+        best = int(numpy.argmax(gain))
+        if gain[best] == 0:
+            break
+        chosen.append(best)
+        uncovered[cover[best].indices] = 0
+
+    # Drop beams whose samples are all covered by the others (latest picks cover least).
+    counts = numpy.asarray(cover[chosen].sum(axis=0)).ravel() if chosen else numpy.zeros(nsamples)
+    for best in chosen[::-1]:
+        mine = cover[best].indices
+        if numpy.all(counts[mine] > 1):
+            counts[mine] -= 1
+            chosen.remove(best)
+
+    codes = [int(code) for code in index['code'][chosen]]
+    plan['codes'] = codes
+    plan['sbeam'] = ["0x{:X}".format(code) for code in codes]
+    plan['covered'] = numpy.count_nonzero(counts > 0)/float(nsamples)
+    plan['coverable'] = numpy.count_nonzero(coverable)/float(nsamples)
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Minimal AMISR-14 beam set covering a region.')
+    parser.add_argument('--polygon', required=True, help='vertices "x1,y1;x2,y2;..."')
+    parser.add_argument('--space', default='dcos', choices=['dcos', 'azel'])
+    parser.add_argument('--threshold', type=float, default=-3.)
+    parser.add_argument('--step', type=float, default=None)
+    parser.add_argument('--coverage', type=float, default=1.0)
+    parser.add_argument('--index', default='UMET_footprints.npy')
+    parser.add_argument('--beamfile', default='UMET_beamcodes.csv')
+    parser.add_argument('--survey', default='UMET_survey.csv')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--fc', type=float, default=445)
+    args = parser.parse_args()
+
+    polygon = [[float(value) for value in vertex.split(',')] for vertex in args.polygon.split(';')]
+    index = footprintIndex(args.index, beamfile=args.beamfile, survey=args.survey,
+                           processes=args.processes, fc=args.fc)
+
+    t0 = time.time()
+    plan = planCoverage(polygon, index, threshold=args.threshold, space=args.space,
+                        step=args.step, coverage=args.coverage)
+    print("%d beams cover %.1f%% of the region (%.1f%% coverable) in %.2f s" %
+          (len(plan['codes']), 100*plan['covered'], 100*plan['coverable'], time.time()-t0))
+    print(",".join(plan['sbeam']))
@@ -0,0 +1,211 @@
+"""
+The module BEAM_POINTING compares the realized main-beam centre (meanpos, see AmisrPattern) of
+every AMISR-14 beamcode in UMET_beamcodes.csv with its commanded azimuth/elevation, writes the
+errors to one CSV table and draws them as a vector field:
+
+    code, azimuth, elevation = beamcode and commanded pointing (degrees)
+    cmd_x, cmd_y             = commanded directional cosines
+    meanpos_x, meanpos_y     = realized beam centre (directional cosines)
+    real_azimuth, real_elevation = realized pointing (degrees)
+    error                    = angle between commanded and realized directions (degrees)
+    source                   = where meanpos was taken from: survey, atlas or computed
+
+Already computed centres are reused: first the table of BEAM_SURVEY, then a BEAM_ATLAS (only for
+beams well inside its grid, whose fit is not truncated by the edges). The remaining beams are
+computed on a process pool with the main-beam window of BEAM_SURVEY.
+
+    python Beam_Pointing.py UMET_pointing.csv --atlas UMET_atlas.npy --plot UMET_pointing.png
+
+MODULES CALLED:
+OS, CSV, TIME, ARGPARSE, MULTIPROCESSING, NUMPY, MATPLOTLIB, BEAM_ATLAS, BEAM_SURVEY
+"""
+
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+import numpy
+
+from Beam_Atlas import BeamAtlas, readBeamcodes
+from Beam_Survey import _beamWindow, readSurvey
+
+
+pointing_fields = ['code', 'azimuth', 'elevation', 'cmd_x', 'cmd_y', 'meanpos_x', 'meanpos_y',
+                   'real_azimuth', 'real_elevation', 'error', 'source']
+
+
+def _computeCentre(args):
+    code, azimuth, elevation, fc = args
+    try:
+        return code, _beamWindow(azimuth, elevation, fc=fc, window=(0.12, 0.03), nwin=81).meanpos
+    except Exception as error:
+        print("Beam %d (%.2f, %.2f) failed: %s" % (code, azimuth, elevation, error))
+        return code, None
+
+
+def pointingErrors(beamfile='UMET_beamcodes.csv', survey=None, atlas=None, processes=None,
+                   fc=445, verbose=True):
+    """
+    pointingErrors returns the realized beam centre and pointing error of every beamcode.
+
+    Parameters
+    ----------
+    beamfile = A string giving the beamcode table. Default is UMET_beamcodes.csv.
+    survey = A string giving a table written by Beam_Survey, or None. Only its rows com-
+      puted at FC are used.
+    atlas = A BeamAtlas (or the name of its file), or None.
+    processes = An integer giving the number of worker processes for the beams that are not
+      in SURVEY or ATLAS. Default is the number of CPUs.
+    fc = A scalar giving the radar frequency in MHz. The default value is 445.
+
+    Return
+    ------
+    rows = A list of dictionaries keyed by pointing_fields, in the order of BEAMFILE.
+    """
+
+    pointings = readBeamcodes(beamfile)
+    codes = pointings[:,0].astype(int)
+    azimuth = pointings[:,1]
+    elevation = pointings[:,2]
+    cmdx = numpy.cos(numpy.radians(elevation))*numpy.sin(numpy.radians(azimuth))
+    cmdy = numpy.cos(numpy.radians(elevation))*numpy.cos(numpy.radians(azimuth))
+
+    centres = {}
+    sources = {}
+
+    if survey is not None and os.path.exists(survey):
+        # As for the atlas, only centres computed at FC are reused.
+        table = readSurvey(survey, fc=fc)
+        for row in table:
+            centres[int(row['code'])] = numpy.array([row['meanpos_x'], row['meanpos_y']])
+            sources[int(row['code'])] = 'survey'
+
+    if isinstance(atlas, str):
+        atlas = BeamAtlas(atlas)
+    if atlas is not None and atlas.fc == fc:
+        # Keep only beams at least a quarter of the grid away from its edges.
+        marginx = 0.25*(atlas.dcosx[-1] - atlas.dcosx[0])
+        marginy = 0.25*(atlas.dcosy[-1] - atlas.dcosy[0])
+        inside = (atlas.index['meanpos'][:,0] > atlas.dcosx[0] + marginx) & \
+                 (atlas.index['meanpos'][:,0] < atlas.dcosx[-1] - marginx) & \
+                 (atlas.index['meanpos'][:,1] > atlas.dcosy[0] + marginy) & \
+                 (atlas.index['meanpos'][:,1] < atlas.dcosy[-1] - marginy)
+        for rec in atlas.index[inside]:
+            if int(rec['code']) not in centres:
+                centres[int(rec['code'])] = numpy.array(rec['meanpos'])
+                sources[int(rec['code'])] = 'atlas'
+
+    jobs = [(code, az, el, fc) for code, az, el in zip(codes, azimuth, elevation)
+            if code not in centres]
+    if verbose:
+        print("%d beams reused, %d to compute" % (len(codes) - len(jobs), len(jobs)))
+
+    t0 = time.time()
+    if len(jobs) > 0:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for ncomp, (code, meanpos) in enumerate(pool.imap_unordered(_computeCentre, jobs,
+                                                                         chunksize=8)):
+                if meanpos is not None:
+                    centres[code] = meanpos
+                    sources[code] = 'computed'
+                if verbose and ((ncomp + 1) % 500 == 0):
+                    print("%d/%d beams (%.1f beams/s)" % (ncomp + 1, len(jobs),
+                                                          (ncomp + 1)/(time.time() - t0)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    rows = []
+    for ib, code in enumerate(codes):
+        if code not in centres:
+            continue
+        mx, my = centres[code]
+        mz = numpy.sqrt(max(1 - mx**2 - my**2, 0.))
+        cz = numpy.sqrt(max(1 - cmdx[ib]**2 - cmdy[ib]**2, 0.))
+        cosang = numpy.clip(mx*cmdx[ib] + my*cmdy[ib] + mz*cz, -1., 1.)
+        rows.append({'code':code, 'azimuth':azimuth[ib], 'elevation':elevation[ib],
+                     'cmd_x':cmdx[ib], 'cmd_y':cmdy[ib], 'meanpos_x':mx, 'meanpos_y':my,
+                     'real_azimuth':numpy.degrees(numpy.arctan2(mx, my)),
+                     'real_elevation':numpy.degrees(numpy.arccos(min(numpy.hypot(mx, my), 1.))),
+                     'error':numpy.degrees(numpy.arccos(cosang)), 'source':sources[code]})
+
+    return rows
+
+
+def writePointing(filename, rows):
+    """
+    writePointing writes the rows of pointingErrors to the CSV table FILENAME.
+    """
+
+    with open(filename, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=pointing_fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def plotPointing(rows, filename=None, scale=None):
+    """
+    plotPointing draws the pointing errors as arrows from the commanded to the realized beam
+    centre (exaggerated by SCALE, by default so that the largest error spans ~5% of the map),
+    colored by the angular error. The figure is saved to FILENAME if given.
+
+    Return
+    ------
+    fig = The matplotlib figure.
+    """
+
+    import matplotlib.pyplot as plt
+
+    cmdx = numpy.array([row['cmd_x'] for row in rows])
+    cmdy = numpy.array([row['cmd_y'] for row in rows])
+    errx = numpy.array([row['meanpos_x'] for row in rows]) - cmdx
+    erry = numpy.array([row['meanpos_y'] for row in rows]) - cmdy
+    error = numpy.array([row['error'] for row in rows])
+
+    if scale is None:
+        scale = 0.05*2/max(numpy.max(numpy.hypot(errx, erry)), 1e-12)
+
+    fig, ax = plt.subplots(figsize=(8, 8))
+    quiv = ax.quiver(cmdx, cmdy, errx*scale, erry*scale, error, angles='xy', scale_units='xy',
+                     scale=1, cmap='viridis', width=0.002)
+    fig.colorbar(quiv, ax=ax, label='Pointing error (degrees)')
+    ax.set_xlim(-1, 1)
+    ax.set_ylim(-1, 1)
+    ax.set_aspect('equal')
+    ax.set_xlabel("West  to  East")
+    ax.set_ylabel("South  to  North")
+    ax.set_title("AMISR-14 pointing error (arrows x%.0f)" % scale)
+    ax.grid(True)
+
+    if filename is not None:
+        fig.savefig(filename, dpi=120)
+    return fig
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pointing errors of every AMISR-14 beamcode.')
+    parser.add_argument('filename', nargs='?', default='UMET_pointing.csv')
+    parser.add_argument('--beamfile', default='UMET_beamcodes.csv')
+    parser.add_argument('--survey', default='UMET_survey.csv')
+    parser.add_argument('--atlas', default='UMET_atlas.npy')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--fc', type=float, default=445)
+    parser.add_argument('--plot', default=None)
+    args = parser.parse_args()
+
+    atlas = args.atlas if os.path.exists(args.atlas) else None
+
+    t0 = time.time()
+    rows = pointingErrors(beamfile=args.beamfile, survey=args.survey, atlas=atlas,
+                          processes=args.processes, fc=args.fc)
+    writePointing(args.filename, rows)
+    error = numpy.array([row['error'] for row in rows])
+    print("%d beams written to %s in %.1f s (median error %.4f deg, max %.4f deg)" %
+          (len(rows), args.filename, time.time()-t0, numpy.median(error), numpy.max(error)))
+
+    if args.plot is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+        plotPointing(rows, filename=args.plot)
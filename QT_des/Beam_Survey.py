@@ -0,0 +1,223 @@
+"""
+The module BEAM_SURVEY computes the main figures of merit of every AMISR-14 beamcode listed in
+UMET_beamcodes.csv on a process pool and writes them to one CSV table:
+
+    code, azimuth, elevation = beamcode and commanded pointing
+    meanpos_x, meanpos_y     = fitted main-beam position (directional cosines)
+    hpbw_x, hpbw_y           = half-power beamwidths (degrees)
+    solid_angle              = beam solid angle, integral of the normalized pattern (sr)
+    directivity              = 4*pi/solid_angle (dBi)
+    sidelobe                 = peak sidelobe level relative to the main beam (dB)
+    grating                  = 1 if a lobe outside the main beam is above -3 dB, else 0
+    scan_loss                = peak gain relative to the zenith beam (dB)
+    fc, npts                 = radar frequency (MHz) and hemisphere grid size of the run
+
+All figures are computed on the one-way (Tx) power pattern. The main beam is modelled on a fine
+window around the commanded pointing; solid angle, sidelobes and grating lobes on a grid covering
+the whole visible hemisphere, dOmega = du*dv/Cz. The main beam is taken to extend 1.25 half-power
+beamwidths from meanpos (the first null of a uniform aperture is at ~1.13).
+
+Rows are appended as beams finish, so an interrupted survey is resumed by running the same command
+again: beamcodes already in the table are skipped. A table is only resumed with the fc and npts it
+was started with.
+
+    python Beam_Survey.py UMET_survey.csv --processes 8
+
+MODULES CALLED:
+OS, CSV, TIME, ARGPARSE, MULTIPROCESSING, NUMPY, PLOTS, MISC_ROUTINES, BEAM_ATLAS
+"""
+
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+import numpy
+
+import Misc_Routines
+from plots import AmisrPattern
+from Beam_Atlas import readBeamcodes
+
+
+survey_fields = ['code', 'azimuth', 'elevation', 'meanpos_x', 'meanpos_y', 'hpbw_x', 'hpbw_y',
+                 'solid_angle', 'directivity', 'sidelobe', 'grating', 'scan_loss', 'fc', 'npts']
+
+
+def _beamWindow(azimuth, elevation, fc=445, window=(0.12, 0.03), nwin=81, just_rx=True):
+    d2r = Misc_Routines.CoFactors.d2r
+    cx0 = numpy.cos(elevation*d2r)*numpy.sin(azimuth*d2r)
+    cy0 = numpy.cos(elevation*d2r)*numpy.cos(azimuth*d2r)
+    wx = cx0 + numpy.linspace(-window[0], window[0], nwin)
+    wy = cy0 + numpy.linspace(-window[1], window[1], nwin)
+    return AmisrPattern(azimuth, elevation, dcosx=wx, dcosy=wy, fc=fc, just_rx=just_rx)
+
+
+def beamMetrics(azimuth, elevation, npts=401, fc=445, window=(0.12, 0.03), nwin=81, zenith=None):
+    """
+    beamMetrics returns the survey figures (see module documentation) of one pointing.
+
+    Parameters
+    ----------
+    azimuth, elevation = Scalars giving the commanded pointing (in degrees).
+    npts = An integer giving the number of points per axis of the hemisphere grid. The de-
+      fault value is 401.
+    fc = A scalar giving the radar frequency in MHz. The default value is 445.
+    window = A 2-elements tuple giving the half-size (directional cosines) in x and y of the
+      main-beam grid, centered on the commanded pointing.
+    nwin = An integer giving the number of points per axis of the main-beam grid.
+    zenith = A scalar giving the peak one-way gain (maxpattern) of the zenith beam, the re-
+      ference of the scan loss. If None it is computed.
+
+    Return
+    ------
+    metrics = A dictionary keyed by survey_fields (code excluded).
+    """
+
+    d2r = Misc_Routines.CoFactors.d2r
+
+    if zenith is None:
+        zenith = _beamWindow(0, 90, fc=fc, window=window, nwin=nwin).maxpattern
+
+    Beam = _beamWindow(azimuth, elevation, fc=fc, window=window, nwin=nwin)
+    meanpos = Beam.meanpos
+    hpbw = Beam.beamwidth
+
+    # Whole visible hemisphere, peak taken from the (finer) main-beam grid.
+    u = numpy.linspace(-1, 1, npts)
+    Full = AmisrPattern(azimuth, elevation, dcosx=u, dcosy=u, fc=fc, just_rx=True)
+    amp = Full.pattern/Beam.maxpattern
+    cx, cy = numpy.meshgrid(u, u)
+    cz2 = 1 - (cx**2 + cy**2)
+    visible = (cz2 > 0) & numpy.isfinite(amp)
+    du = u[1] - u[0]
+    solid = numpy.sum(amp[visible]/numpy.sqrt(cz2[visible]))*du*du
+
+    semix = 1.25*hpbw[0]*d2r
+    semiy = 1.25*hpbw[1]*d2r
+    outside = visible & ((((cx - meanpos[0])/semix)**2 + ((cy - meanpos[1])/semiy)**2) > 1)
+    sidelobe = numpy.max(amp[outside]) if outside.any() else 0.
+
+    return {'azimuth':azimuth, 'elevation':elevation,
+            'meanpos_x':meanpos[0], 'meanpos_y':meanpos[1], 'hpbw_x':hpbw[0], 'hpbw_y':hpbw[1],
+            'solid_angle':solid, 'directivity':10*numpy.log10(4*numpy.pi/solid),
+            'sidelobe':10*numpy.log10(max(sidelobe, 1e-30)), 'grating':int(sidelobe > 0.5),
+            'scan_loss':10*numpy.log10(Beam.maxpattern/zenith), 'fc':fc, 'npts':npts}
+
+
+def _surveyBeam(args):
+    code, azimuth, elevation, options = args
+    try:
+        metrics = beamMetrics(azimuth, elevation, **options)
+    except Exception as error:
+        print("Beam %d (%.2f, %.2f) failed: %s" % (code, azimuth, elevation, error))
+        return None
+    metrics['code'] = int(code)
+    return metrics
+
+
+def readSurvey(filename, fc=None):
+    """
+    readSurvey returns the survey table as a numpy structured array (one row per beam). If
+    FC is given only the rows computed at that frequency are returned (none for tables that
+    do not record it).
+    """
+
+    table = numpy.genfromtxt(filename, delimiter=',', names=True, dtype=None, encoding=None)
+    if fc is None:
+        return table
+    table = numpy.atleast_1d(table)
+    if 'fc' not in table.dtype.names:
+        return table[:0]
+    return table[table['fc'] == fc]
+
+
+def surveyBeams(filename, beamfile='UMET_beamcodes.csv', processes=None, npts=401, fc=445,
+                verbose=True):
+    """
+    surveyBeams computes the metrics of every beamcode in BEAMFILE and appends them to the CSV
+    table FILENAME. Beamcodes already in FILENAME are skipped, so the survey is resumed when
+    it is run again after an interruption. A ValueError is raised if FILENAME was computed
+    with other options (fc, npts), so that a table never mixes runs.
+
+    Parameters
+    ----------
+    filename = A string giving the output (and checkpoint) table.
+    beamfile = A string giving the beamcode table. Default is UMET_beamcodes.csv.
+    processes = An integer giving the number of worker processes. Default is the number of
+      CPUs.
+    npts = An integer giving the hemisphere grid size (see beamMetrics).
+    fc = A scalar giving the radar frequency in MHz. The default value is 445.
+
+    Return
+    ------
+    nbeams, rate = The number of beams computed in this run and the throughput (beams/s).
+
+    Examples
+    --------
+    >> surveyBeams('UMET_survey.csv', processes=8)
+    >> table = readSurvey('UMET_survey.csv')
+    >> best = table[table['sidelobe'] < -13]
+    """
+
+    pointings = readBeamcodes(beamfile)
+
+    done = set()
+    header = not (os.path.exists(filename) and os.path.getsize(filename) > 0)
+    if not header:
+        with open(filename) as fp:
+            reader = csv.DictReader(fp)
+            if reader.fieldnames != survey_fields:
+                raise ValueError("%s has other columns than this survey (no fc/npts?), use a "
+                                 "new file" % filename)
+            for row in reader:
+                if float(row['fc']) != fc or int(row['npts']) != npts:
+                    raise ValueError("%s was computed with fc=%s, npts=%s; resume it with the "
+                                     "same options or use a new file" %
+                                     (filename, row['fc'], row['npts']))
+                done.add(int(row['code']))
+
+    zenith = _beamWindow(0, 90, fc=fc).maxpattern
+    options = {'npts':npts, 'fc':fc, 'zenith':zenith}
+    jobs = [(int(row[0]), row[1], row[2], options) for row in pointings if int(row[0]) not in done]
+    if verbose:
+        print("%d beams to survey (%d already in %s)" % (len(jobs), len(done), filename))
+
+    t0 = time.time()
+    nbeams = 0
+    with open(filename, 'a', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=survey_fields, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for metrics in pool.imap_unordered(_surveyBeam, jobs, chunksize=4):
+                if metrics is None:
+                    continue
+                writer.writerow(metrics)
+                fp.flush()
+                nbeams += 1
+                if verbose and (nbeams % 100 == 0):
+                    print("%d/%d beams (%.1f beams/s)" % (nbeams, len(jobs), nbeams/(time.time()-t0)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    rate = nbeams/max(time.time() - t0, 1e-9)
+    return nbeams, rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Survey the metrics of every AMISR-14 beamcode.')
+    parser.add_argument('filename', nargs='?', default='UMET_survey.csv')
+    parser.add_argument('--beamfile', default='UMET_beamcodes.csv')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--npts', type=int, default=401)
+    parser.add_argument('--fc', type=float, default=445)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    nbeams, rate = surveyBeams(args.filename, beamfile=args.beamfile, processes=args.processes,
+                               npts=args.npts, fc=args.fc)
+    print("%d beams written to %s in %.1f s (%.1f beams/s)" % (nbeams, args.filename,
+                                                               time.time()-t0, rate))
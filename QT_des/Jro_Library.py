@@ -0,0 +1,245 @@
+"""
+The module JRO_LIBRARY precomputes the JroPattern of every predefined Jicamarca configuration (see
+PATTERN_REGISTRY) at a few standard resolutions into one memory-mapped file, so that overjro_plot
+serves them instead of computing the pattern on every request.
+
+The library file is a sequence of standard .npy blocks (as BEAM_ATLAS):
+
+    grids   = [maxphi, nptsx, nptsy] of every standard resolution (nres x 3)
+    then, for every resolution:
+    dcosx   = x-axis directional cosines (nptsx)
+    dcosy   = y-axis directional cosines (nptsy)
+    pattern = normalized patterns, float16 (nids, nptsx, nptsy), memory-mapped on read
+    and last:
+    index   = configuration ID, title, setup digest and, per resolution, valid flag, meanpos,
+              beamwidth and maxpattern
+
+Patterns are stored in the layout of JroPattern (nx, ny) and, as in the atlas, as float16: the
+relative error is at most 2**-11 above -42 dB. A pattern is only served when the requested grid is
+a standard one and the digest of the requested configuration (ues, phases, gains, just_rx) equals
+the stored one, so edited or user-defined configurations are always computed.
+
+Build from the command line (inside QT_des):
+
+    python Jro_Library.py JRO_library.npy --maxphi 5 10 15 20 --npts 101
+
+MODULES CALLED:
+OS, TIME, HASHLIB, ARGPARSE, NUMPY, PLOTS, PATTERN_CACHE, PATTERN_REGISTRY, BEAM_ATLAS
+"""
+
+import os
+import time
+import hashlib
+import argparse
+import numpy
+
+from plots import JroPattern
+from Pattern_Cache import CachedPattern
+from Pattern_Registry import registry
+from Beam_Atlas import _writeBlock
+
+
+def setupDigest(ues, phase, gaintx, gainrx, justrx):
+    """
+    setupDigest returns the SHA-1 (hex string) that identifies a JRO antenna configuration.
+    """
+
+    sha = hashlib.sha1()
+    for array in (ues, phase, gaintx, gainrx):
+        sha.update(numpy.ascontiguousarray(array, dtype=numpy.float64).tobytes())
+    sha.update(str(int(justrx)).encode())
+    return sha.hexdigest()
+
+
+def _indexDtype(nres):
+    return numpy.dtype([('id','i8'), ('title','U64'), ('digest','U40'), ('valid','?',(nres,)),
+                        ('meanpos','f8',(nres,2)), ('beamwidth','f8',(nres,2)),
+                        ('maxpattern','f8',(nres,))])
+
+
+def buildLibrary(filename, maxphi=(5, 10, 15, 20), nptsx=101, nptsy=101, ids=None, verbose=True):
+    """
+    buildLibrary computes the JroPattern of every predefined configuration at every MAXPHI
+    and writes the library to FILENAME. Patterns are streamed to disk one at a time.
+
+    Parameters
+    ----------
+    filename = A string giving the output library file.
+    maxphi = A list of scalars giving the standard half-widths of the grids (degrees).
+    nptsx, nptsy = Integers giving the number of points of the grids.
+    ids = A list of configuration IDs. Default is every ID of the registry.
+
+    Return
+    ------
+    npatterns = The number of patterns written.
+    """
+
+    if ids is None:
+        ids = registry.ids()
+    grids = numpy.array([[phi, nptsx, nptsy] for phi in numpy.atleast_1d(maxphi)], dtype=float)
+    nres = grids.shape[0]
+
+    index = numpy.zeros(len(ids), dtype=_indexDtype(nres))
+    setups = []
+    for irow, pattern_id in enumerate(ids):
+        setup = registry.get(pattern_id)
+        setups.append(setup)
+        index['id'][irow] = pattern_id
+        index['title'][irow] = setup['title'][:64]
+        index['digest'][irow] = setupDigest(setup['ues'], setup['phase'], setup['gaintx'],
+                                            setup['gainrx'], setup['justrx'])
+
+    t0 = time.time()
+    npatterns = 0
+    with open(filename, 'wb') as fp:
+        _writeBlock(fp, grids)
+        for ires, (phi, nx, ny) in enumerate(grids):
+            nx = int(nx); ny = int(ny)
+            maxdcos = numpy.sin(numpy.radians(phi))
+            dcosx = ((numpy.arange(nx, dtype=float)/(nx-1))-0.5)*2*maxdcos
+            dcosy = ((numpy.arange(ny, dtype=float)/(ny-1))-0.5)*2*maxdcos
+            _writeBlock(fp, dcosx)
+            _writeBlock(fp, dcosy)
+            _writeBlock(fp, None, shape=(len(ids), nx, ny), dtype=numpy.float16)
+
+            for irow, setup in enumerate(setups):
+                norpattern = numpy.zeros((nx, ny), dtype=numpy.float16)
+                try:
+                    ObjAnt = JroPattern(pattern=0, nptsx=nx, nptsy=ny, maxphi=phi, ues=setup['ues'],
+                                        phases=setup['phase'], gain_tx=setup['gaintx'],
+                                        gain_rx=setup['gainrx'], just_rx=setup['justrx'])
+                    norpattern = ObjAnt.norpattern.astype(numpy.float16)
+                    index['meanpos'][irow,ires] = ObjAnt.meanpos
+                    index['beamwidth'][irow,ires] = ObjAnt.beamwidth
+                    index['maxpattern'][irow,ires] = ObjAnt.maxpattern
+                    index['valid'][irow,ires] = True
+                    npatterns += 1
+                except Exception as error:
+                    if verbose:
+                        print("Pattern %d (maxphi %g) failed: %s" % (index['id'][irow], phi, error))
+                fp.write(norpattern.tobytes())
+
+            if verbose:
+                print("maxphi %g: %d patterns (%.1f patterns/s)" % (phi, len(ids),
+                                                                   npatterns/(time.time()-t0)))
+
+        _writeBlock(fp, index)
+
+    return npatterns
+
+
+class JroLibrary():
+
+    def __init__(self, filename):
+        """
+        JroLibrary opens a library written by buildLibrary. The pattern stacks are memory-
+        mapped, so only the pages of the patterns actually read are loaded.
+
+        Examples
+        --------
+        >> library = JroLibrary('JRO_library.npy')
+        >> ObjAnt = library.get(2, maxphi=5)
+        >> print ObjAnt.meanpos
+        """
+
+        self.filename = filename
+
+        blocks = []
+        with open(filename, 'rb') as fp:
+            nblocks = 2
+            while len(blocks) < nblocks:
+                version = numpy.lib.format.read_magic(fp)
+                if version == (1, 0):
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(fp)
+                else:
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(fp)
+                offset = fp.tell()
+                nbytes = int(numpy.prod(shape))*dtype.itemsize
+                if len(blocks) > 0 and len(blocks) % 3 == 0 and len(blocks) < nblocks - 1:
+                    blocks.append(numpy.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                                               shape=shape))
+                    fp.seek(offset + nbytes)
+                else:
+                    blocks.append(numpy.frombuffer(fp.read(nbytes), dtype=dtype).reshape(shape))
+                if len(blocks) == 1:
+                    nblocks = 2 + 3*blocks[0].shape[0]
+
+        self.grids = blocks[0]
+        self.dcosx = blocks[1:-1:3]
+        self.dcosy = blocks[2:-1:3]
+        self.patterns = blocks[3:-1:3]
+        self.index = blocks[-1]
+
+        self.__rows = dict(zip(self.index['id'].tolist(), range(self.index.size)))
+
+    def __len__(self):
+        return self.index.size
+
+    def __contains__(self, pattern_id):
+        return pattern_id in self.__rows
+
+    def grid(self, maxphi, nptsx=101, nptsy=101):
+        """
+        grid returns the resolution number of a standard grid, or None.
+        """
+
+        match = numpy.nonzero((self.grids[:,0] == maxphi) & (self.grids[:,1] == nptsx) &
+                              (self.grids[:,2] == nptsy))[0]
+        return int(match[0]) if match.size > 0 else None
+
+    def get(self, pattern_id, maxphi=5, nptsx=101, nptsy=101):
+        """
+        get returns a CachedPattern of a configuration ID on a standard grid (see pattern),
+        or None.
+        """
+
+        irow = self.__rows.get(pattern_id)
+        ires = self.grid(maxphi, nptsx, nptsy)
+        if irow is None or ires is None:
+            return None
+        return self.__pattern(irow, ires)
+
+    def pattern(self, phases, gain_tx, gain_rx, ues, just_rx, maxphi=5, nptsx=101, nptsy=101,
+                pattern_id=None):
+        """
+        pattern returns the CachedPattern of a configuration (as given to JroPattern) if the
+        library has it on the requested grid, otherwise None so the caller can compute it.
+        The configuration is matched by its digest, so only unchanged predefined configura-
+        tions are served. PATTERN_ID, if known, skips the search by digest.
+        """
+
+        ires = self.grid(maxphi, nptsx, nptsy)
+        if ires is None:
+            return None
+
+        digest = setupDigest(ues, phases, gain_tx, gain_rx, just_rx)
+        irow = self.__rows.get(pattern_id)
+        if irow is None or self.index['digest'][irow] != digest:
+            match = numpy.nonzero(self.index['digest'] == digest)[0]
+            if match.size == 0:
+                return None
+            irow = int(match[0])
+        return self.__pattern(irow, ires)
+
+    def __pattern(self, irow, ires):
+        rec = self.index[irow]
+        if not rec['valid'][ires]:
+            return None
+        pattern = CachedPattern(self.patterns[ires][irow], rec['maxpattern'][ires],
+                                self.dcosx[ires], self.dcosy[ires], rec['meanpos'][ires],
+                                transposed=True)
+        pattern.beamwidth = rec['beamwidth'][ires]
+        pattern.title = rec['title']
+        return pattern
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the library of predefined JRO patterns.')
+    parser.add_argument('filename', nargs='?', default='JRO_library.npy')
+    parser.add_argument('--maxphi', type=float, nargs='+', default=[5, 10, 15, 20])
+    parser.add_argument('--npts', type=int, default=101)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    npatterns = buildLibrary(args.filename, maxphi=args.maxphi, nptsx=args.npts, nptsy=args.npts)
+    print("%d patterns written to %s in %.1f s" % (npatterns, args.filename, time.time()-t0))
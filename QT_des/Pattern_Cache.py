@@ -0,0 +1,228 @@
+"""
+The module PATTERN_CACHE keeps  already computed AMISR-14 antenna patterns so that redrawing a beam
+does not recompute it. Patterns are kept in a bounded in-memory LRU and, optionally, in a directory
+of .npz files whose total size is capped. A beam atlas (see BEAM_ATLAS) can be attached as a read-
+only tier consulted before computing.
+
+MODULES CALLED:
+OS, HASHLIB, COLLECTIONS, NUMPY, PLOTS
+"""
+
+import os
+import hashlib
+import collections
+import numpy
+
+from plots import AmisrPattern, patternIsolines
+
+
+class CachedPattern():
+    """
+    CachedPattern holds the results of an AmisrPattern that consumers (e.g.  PlotPatronRa,
+    contPattern, plotPattern) read: norpattern, maxpattern, dcosx, dcosy, meanpos, getcut,
+    the refined patches of AmisrPattern.getZoom (None if not refined) and beamwidth (None if
+    not known, e.g. for atlas patterns). The isolines of the
+    map are extracted on first use and kept, so redraws do not run contour again. TRANSPOSED
+    is True when norpattern is (nx, ny), as for JroPattern.
+    """
+
+    def __init__(self, norpattern, maxpattern, dcosx, dcosy, meanpos, getcut=0, patches=None,
+                 transposed=False, beamwidth=None):
+        self.norpattern = norpattern
+        self.maxpattern = maxpattern
+        self.dcosx = dcosx
+        self.dcosy = dcosy
+        self.meanpos = meanpos
+        self.getcut = getcut
+        self.patches = patches
+        self.transposed = transposed
+        self.beamwidth = beamwidth
+        self._isolines = None
+
+    @property
+    def pattern(self):
+        return self.norpattern*self.maxpattern
+
+    @property
+    def isolines(self):
+        if self._isolines is None:
+            amp = self.norpattern.T if self.transposed else self.norpattern
+            self._isolines = patternIsolines(amp, self.dcosx, self.dcosy, patches=self.patches)
+        return self._isolines
+
+
+class PatternCache():
+
+    def __init__(self, maxsize=32, path=None, maxbytes=256*1024**2, atlas=None):
+        """
+        PatternCache creates a memoizing store of AMISR-14 patterns.
+
+        Parameters
+        ----------
+        maxsize = An integer giving the number of patterns kept in memory.  The least  re-
+          cently used pattern is dropped first. The default value is 32.
+        path = A string giving the directory of the on-disk tier. If None (default value)
+          only the in-memory tier is used.
+        maxbytes = A scalar giving the maximum size (in bytes) of the on-disk tier. Oldest
+          files are removed first. The default value is 256 MB.
+        atlas = A Beam_Atlas.BeamAtlas to read precomputed patterns from before computing
+          them. The default value is None.
+
+        Examples
+        --------
+        >> cache = PatternCache(maxsize=16, path='/tmp/amisr_patterns')
+        >> ObjAnt = cache.get(azimuth=30, elevation=70, maxphi=33)
+        >> print ObjAnt.meanpos
+        """
+
+        self.maxsize = maxsize
+        self.path = path
+        self.maxbytes = maxbytes
+        self.atlas = atlas
+        self.hits = 0
+        self.misses = 0
+
+        self.__memory = collections.OrderedDict()
+
+        if self.path is not None and not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def get(self, azimuth=0, elevation=90, maxphi=40, nptsx=101, nptsy=101, fc=445,
+            just_rx=False, wgts=[], xy_panelPos=[], zoom=False):
+        """
+        get returns the pattern for the given parameters, computing it only if it is  not
+        already in memory or on disk. Inputs are the same as AmisrPattern/getPattern;  set
+        ZOOM to True to also get the refined patches of AmisrPattern.getZoom (an atlas pat-
+        tern is then refined, only the patches are computed).
+
+        Return
+        ------
+        pattern = A CachedPattern with norpattern, maxpattern, dcosx, dcosy and meanpos.
+        """
+
+        key = self.key(azimuth, elevation, maxphi, nptsx, nptsy, fc, just_rx, wgts, xy_panelPos,
+                       zoom)
+
+        if key in self.__memory:
+            self.hits += 1
+            self.__memory.move_to_end(key)
+            return self.__memory[key]
+
+        pattern = None
+        if self.atlas is not None and len(wgts)==0 and len(xy_panelPos)==0:
+            pattern = self.atlas.pattern(azimuth, elevation, maxphi=maxphi, nptsx=nptsx,
+                                         nptsy=nptsy, fc=fc, just_rx=just_rx)
+            if pattern is not None and zoom:
+                # The pointing is all getZoom needs from the object: no pattern is computed.
+                ObjAnt = AmisrPattern(azimuth, elevation, dcosx=pattern.dcosx,
+                                      dcosy=pattern.dcosy, fc=fc, just_rx=just_rx, compute=False)
+                ObjAnt.getZoom(coarse=pattern)
+                pattern = CachedPattern(ObjAnt.norpattern, ObjAnt.maxpattern, ObjAnt.dcosx,
+                                        ObjAnt.dcosy, ObjAnt.meanpos, ObjAnt.getcut,
+                                        ObjAnt.patches, beamwidth=ObjAnt.beamwidth)
+        if pattern is None:
+            pattern = self.__readDisk(key)
+        if pattern is None:
+            self.misses += 1
+            ObjAnt = AmisrPattern(azimuth, elevation, maxphi=maxphi, nptsx=nptsx, nptsy=nptsy,
+                                  fc=fc, just_rx=just_rx)
+            if len(wgts)>0 or len(xy_panelPos)>0:
+                ObjAnt.getPattern(xy_panelPos=xy_panelPos, wgts=wgts)
+            if zoom:
+                ObjAnt.getZoom()
+            pattern = CachedPattern(ObjAnt.norpattern, ObjAnt.maxpattern, ObjAnt.dcosx,
+                                    ObjAnt.dcosy, ObjAnt.meanpos, ObjAnt.getcut, ObjAnt.patches,
+                                    beamwidth=ObjAnt.beamwidth)
+            self.__writeDisk(key, pattern)
+        else:
+            self.hits += 1
+
+        self.__memory[key] = pattern
+        while len(self.__memory)>self.maxsize:
+            self.__memory.popitem(last=False)
+
+        return pattern
+
+    def clear(self, disk=False):
+        """
+        clear empties the in-memory tier and, if DISK is True, the on-disk tier.
+        """
+
+        self.__memory.clear()
+        if disk and self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, name))
+
+    def __len__(self):
+        return len(self.__memory)
+
+    @staticmethod
+    def key(azimuth, elevation, maxphi, nptsx, nptsy, fc, just_rx, wgts=[], xy_panelPos=[],
+            zoom=False):
+        """
+        key returns the hashable tuple that identifies a pattern. Angles are rounded to 1e-6
+        degree so that values read back from a table map to the same entry.
+        """
+
+        wgts = tuple(numpy.round(numpy.asarray(wgts, dtype=complex).ravel(), 12).tolist())
+        panel = tuple(numpy.round(numpy.asarray(xy_panelPos, dtype=float).ravel(), 9).tolist())
+
+        return (round(float(azimuth), 6), round(float(elevation), 6), float(maxphi), int(nptsx),
+                int(nptsy), float(fc), bool(just_rx), wgts, panel) + ((True,) if zoom else ())
+
+    def __filename(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.path, 'amisr_%s.npz' % digest)
+
+    def __readDisk(self, key):
+        if self.path is None:
+            return None
+
+        filename = self.__filename(key)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with numpy.load(filename) as data:
+                patches = None
+                if 'patch0_norpattern' in data:
+                    patches = []
+                    while 'patch%d_norpattern' % len(patches) in data:
+                        name = 'patch%d_' % len(patches)
+                        patches.append((data[name+'norpattern'], data[name+'dcosx'], data[name+'dcosy']))
+                beamwidth = data['beamwidth'] if 'beamwidth' in data else None
+                pattern = CachedPattern(data['norpattern'], float(data['maxpattern']),
+                                        data['dcosx'], data['dcosy'], data['meanpos'],
+                                        patches=patches, beamwidth=beamwidth)
+        except (IOError, ValueError, KeyError):
+            os.remove(filename)
+            return None
+
+        # Refreshing mtime keeps the disk tier in LRU order.
+        os.utime(filename, None)
+        return pattern
+
+    def __writeDisk(self, key, pattern):
+        if self.path is None:
+            return
+
+        filename = self.__filename(key)
+        patches = {}
+        for ipatch, (norpattern, dcosx, dcosy) in enumerate(pattern.patches or []):
+            patches['patch%d_norpattern' % ipatch] = norpattern
+            patches['patch%d_dcosx' % ipatch] = dcosx
+            patches['patch%d_dcosy' % ipatch] = dcosy
+        if pattern.beamwidth is not None:
+            patches['beamwidth'] = pattern.beamwidth
+        numpy.savez(filename, norpattern=pattern.norpattern, maxpattern=pattern.maxpattern,
+                    dcosx=pattern.dcosx, dcosy=pattern.dcosy, meanpos=pattern.meanpos, **patches)
+
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                 if name.endswith('.npz')]
+        files.sort(key=os.path.getmtime)
+        total = sum([os.path.getsize(name) for name in files])
+        while total>self.maxbytes and len(files)>1:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
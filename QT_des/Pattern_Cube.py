@@ -0,0 +1,396 @@
+"""
+The module PATTERN_CUBE exports stacks of antenna patterns (AmisrPattern, JroPattern or cached
+ones) to one compressed, chunked file, and reads them back lazily so that analysis scripts reuse
+computed patterns instead of regenerating them.
+
+The file is a standard .npz (zip) archive, readable with numpy.load, with the members:
+
+    layout     = [nbeams, chunk, n0, n1], n0 x n1 being the shape of one pattern
+    dcosx      = x-axis directional cosines
+    dcosy      = y-axis directional cosines
+    index      = beamcode, commanded azimuth/elevation, meanpos, beamwidth and maxpattern per beam
+    attrs      = JSON string of free metadata (grid and model parameters, source class, ...)
+    chunkNNNNN = normalized patterns of beams NNNNN*chunk ... (NNNNN+1)*chunk-1, deflated
+
+Patterns are stored with the layout of their source (AmisrPattern is (ny, nx), JroPattern is
+(nx, ny)). Reading a beam decompresses only the chunk that holds it.
+
+    python Pattern_Cube.py UMET_cube.npz --codes 0xF923,0xF924 --atlas UMET_atlas.npy \
+                                         --survey UMET_survey.csv
+
+MODULES CALLED:
+JSON, ZIPFILE, COLLECTIONS, ARGPARSE, TIME, NUMPY, PATTERN_CACHE, BEAM_ATLAS, BEAM_SURVEY
+"""
+
+import json
+import zipfile
+import collections
+import argparse
+import time
+import numpy
+
+from Pattern_Cache import CachedPattern, PatternCache
+from Beam_Atlas import BeamAtlas, readBeamcodes
+from Beam_Survey import _beamWindow, readSurvey
+
+
+cube_dtype = numpy.dtype([('code','i8'), ('azimuth','f8'), ('elevation','f8'),
+                          ('meanpos','f8',(2,)), ('beamwidth','f8',(2,)), ('maxpattern','f8')])
+
+
+def _writeMember(zf, name, array):
+    with zf.open(name + '.npy', 'w', force_zip64=True) as fp:
+        numpy.lib.format.write_array(fp, numpy.asanyarray(array), allow_pickle=False)
+
+
+def _readMember(zf, name):
+    with zf.open(name + '.npy') as fp:
+        return numpy.lib.format.read_array(fp, allow_pickle=False)
+
+
+class CubeWriter():
+
+    def __init__(self, filename, dcosx, dcosy, chunk=16, dtype=numpy.float32, compress=True,
+                 attrs=None):
+        """
+        CubeWriter streams patterns to a cube file, one chunk of beams at a time, so that the
+        whole stack never has to be in memory.
+
+        Parameters
+        ----------
+        filename = A string giving the output file (.npz).
+        dcosx, dcosy = 1-D arrays giving the grid of the patterns.
+        chunk = An integer giving the number of beams per chunk, the unit read by PatternCube.
+          The default value is 16.
+        dtype = The numpy type of the stored patterns. The default is float32.
+        compress = Set to False to store the chunks without deflating them.
+        attrs = A dictionary of JSON-serializable metadata (e.g. maxphi, fc, just_rx).
+
+        Examples
+        --------
+        >> with CubeWriter('cube.npz', ObjAnt.dcosx, ObjAnt.dcosy, attrs={'fc':445}) as cube:
+        >>     for az, el in pointings:
+        >>         cube.writePattern(AmisrPattern(az, el, maxphi=33), azimuth=az, elevation=el)
+        """
+
+        self.filename = filename
+        self.chunk = int(chunk)
+        self.dtype = numpy.dtype(dtype)
+        self.attrs = dict(attrs or {})
+        self.dcosx = numpy.asarray(dcosx, dtype=float)
+        self.dcosy = numpy.asarray(dcosy, dtype=float)
+
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.__zf = zipfile.ZipFile(filename, 'w', compression=compression, allowZip64=True)
+        self.__shape = None
+        self.__buffer = []
+        self.__index = []
+        self.__nchunks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.__index)
+
+    def write(self, norpattern, azimuth=numpy.nan, elevation=numpy.nan, code=-1, meanpos=None,
+              beamwidth=None, maxpattern=numpy.nan):
+        """
+        write appends one normalized pattern and its beam parameters to the cube.
+        """
+
+        norpattern = numpy.asarray(norpattern)
+        if self.__shape is None:
+            self.__shape = norpattern.shape
+        elif norpattern.shape != self.__shape:
+            raise ValueError("Pattern shape %s does not match the cube shape %s" %
+                             (norpattern.shape, self.__shape))
+
+        rec = numpy.zeros((), dtype=cube_dtype)
+        rec['code'] = code
+        rec['azimuth'] = azimuth
+        rec['elevation'] = elevation
+        rec['meanpos'] = numpy.nan if meanpos is None else meanpos
+        rec['beamwidth'] = numpy.nan if beamwidth is None else beamwidth
+        rec['maxpattern'] = maxpattern
+        self.__index.append(rec)
+
+        self.__buffer.append(norpattern.astype(self.dtype))
+        if len(self.__buffer) == self.chunk:
+            self.__flush()
+
+    def writePattern(self, ObjAnt, azimuth=None, elevation=None, code=-1):
+        """
+        writePattern appends a computed pattern (AmisrPattern, JroPattern or CachedPattern).
+        AZIMUTH and ELEVATION default to the ones of OBJANT, if it has them.
+        """
+
+        if azimuth is None:
+            azimuth = getattr(ObjAnt, 'azimuth', numpy.nan)
+        if elevation is None:
+            elevation = getattr(ObjAnt, 'elevation', numpy.nan)
+        self.write(ObjAnt.norpattern, azimuth=azimuth, elevation=elevation, code=code,
+                   meanpos=ObjAnt.meanpos, beamwidth=getattr(ObjAnt, 'beamwidth', None),
+                   maxpattern=ObjAnt.maxpattern)
+        self.attrs.setdefault('source', type(ObjAnt).__name__)
+
+    def close(self):
+        """
+        close writes the last chunk and the metadata. The file is only valid once closed.
+        """
+
+        if self.__zf is None:
+            return
+        if len(self.__buffer) > 0:
+            self.__flush()
+
+        shape = self.__shape or (0, 0)
+        _writeMember(self.__zf, 'layout', numpy.array([len(self.__index), self.chunk,
+                                                       shape[0], shape[1]], dtype='i8'))
+        _writeMember(self.__zf, 'dcosx', self.dcosx)
+        _writeMember(self.__zf, 'dcosy', self.dcosy)
+        _writeMember(self.__zf, 'index', numpy.array(self.__index, dtype=cube_dtype))
+        _writeMember(self.__zf, 'attrs', numpy.array(json.dumps(self.attrs)))
+        self.__zf.close()
+        self.__zf = None
+
+    def __flush(self):
+        _writeMember(self.__zf, 'chunk%05d' % self.__nchunks, numpy.stack(self.__buffer))
+        self.__nchunks += 1
+        self.__buffer = []
+
+
+def writeCube(filename, patterns, dcosx=None, dcosy=None, index=None, chunk=16,
+              dtype=numpy.float32, attrs=None):
+    """
+    writeCube writes a list of computed patterns, or an (nbeams, n0, n1) array of normalized
+    patterns, to the cube file FILENAME.
+
+    Parameters
+    ----------
+    patterns = A list of AmisrPattern/JroPattern/CachedPattern objects, or a 3-D array.
+    dcosx, dcosy = The grid. By default the one of the first pattern object.
+    index = A structured array with (some of) the fields of cube_dtype, one row per beam,
+      overriding the parameters taken from the pattern objects.
+    chunk, dtype, attrs = See CubeWriter.
+
+    Return
+    ------
+    nbeams = The number of beams written.
+    """
+
+    if dcosx is None:
+        dcosx = patterns[0].dcosx
+    if dcosy is None:
+        dcosy = patterns[0].dcosy
+
+    with CubeWriter(filename, dcosx, dcosy, chunk=chunk, dtype=dtype, attrs=attrs) as cube:
+        for ib, pattern in enumerate(patterns):
+            pars = {}
+            if hasattr(pattern, 'norpattern'):
+                cube.attrs.setdefault('source', type(pattern).__name__)
+                pars = {'meanpos':pattern.meanpos, 'maxpattern':pattern.maxpattern,
+                        'beamwidth':getattr(pattern, 'beamwidth', None)}
+                pattern = pattern.norpattern
+            if index is not None:
+                for name in index.dtype.names:
+                    if name in cube_dtype.names:
+                        pars[name] = index[ib][name]
+            cube.write(pattern, **pars)
+        nbeams = len(cube)
+
+    return nbeams
+
+
+class PatternCube():
+
+    def __init__(self, filename, cachesize=4):
+        """
+        PatternCube opens a cube written by CubeWriter/writeCube. Only the metadata is read
+        on opening; patterns are decompressed chunk by chunk when they are indexed, and the
+        last CACHESIZE chunks are kept.
+
+        Examples
+        --------
+        >> cube = PatternCube('UMET_cube.npz')
+        >> amp = cube[3]                 # one beam, reads one chunk
+        >> amps = cube[10:20, 40:60, :]  # beams 10-19, rows 40-59
+        >> ObjAnt = cube.get(0xF923)
+        """
+
+        self.filename = filename
+        self.cachesize = cachesize
+
+        self.__zf = zipfile.ZipFile(filename, 'r')
+        layout = _readMember(self.__zf, 'layout')
+        self.nbeams = int(layout[0])
+        self.chunk = int(layout[1])
+        self.shape = (self.nbeams, int(layout[2]), int(layout[3]))
+        self.dcosx = _readMember(self.__zf, 'dcosx')
+        self.dcosy = _readMember(self.__zf, 'dcosy')
+        self.index = _readMember(self.__zf, 'index')
+        self.attrs = json.loads(str(_readMember(self.__zf, 'attrs')))
+
+        self.__rows = dict(zip(self.index['code'].tolist(), range(self.nbeams)))
+        self.__chunks = collections.OrderedDict()
+        self.nread = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.nbeams
+
+    def __contains__(self, code):
+        return self.row(code) is not None
+
+    def close(self):
+        if self.__zf is not None:
+            self.__zf.close()
+            self.__zf = None
+        self.__chunks.clear()
+
+    def row(self, code):
+        """
+        row returns the beam row of a beamcode (integer or '0x...' string) or None.
+        """
+
+        if isinstance(code, str):
+            code = int(code, 16) if code.lower().startswith('0x') else int(code)
+        if int(code) < 0:
+            return None
+        return self.__rows.get(int(code))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        beams = numpy.arange(self.nbeams)[key[0]]
+
+        if numpy.ndim(beams) == 0:
+            amp = self.__chunk(int(beams)//self.chunk)[int(beams) % self.chunk]
+        else:
+            amp = numpy.empty((beams.size,) + self.shape[1:],
+                              dtype=self.__chunk(0).dtype if self.nbeams > 0 else float)
+            for ichunk in numpy.unique(beams//self.chunk):
+                sel = numpy.nonzero(beams//self.chunk == ichunk)[0]
+                amp[sel] = self.__chunk(int(ichunk))[beams[sel] % self.chunk]
+
+        return amp[(Ellipsis,) + key[1:]] if len(key) > 1 else amp
+
+    def get(self, code=None, row=None):
+        """
+        get returns a Pattern_Cache.CachedPattern for a beamcode (or a beam ROW), or None if
+        the cube does not have it. Patterns of a JroPattern cube are flagged as transposed.
+        """
+
+        if row is None:
+            row = self.row(code)
+        if row is None:
+            return None
+        rec = self.index[row]
+        pattern = CachedPattern(self[row], rec['maxpattern'], self.dcosx, self.dcosy,
+                                rec['meanpos'], transposed=self.attrs.get('source')=='JroPattern')
+        pattern.beamwidth = rec['beamwidth']
+        return pattern
+
+    def __chunk(self, ichunk):
+        if ichunk in self.__chunks:
+            self.__chunks.move_to_end(ichunk)
+            return self.__chunks[ichunk]
+
+        data = _readMember(self.__zf, 'chunk%05d' % ichunk)
+        self.nread += 1
+        self.__chunks[ichunk] = data
+        while len(self.__chunks) > self.cachesize:
+            self.__chunks.popitem(last=False)
+        return data
+
+
+def exportBeams(filename, codes=None, beamfile='UMET_beamcodes.csv', maxphi=33, nptsx=101,
+                nptsy=101, fc=445, just_rx=False, atlas=None, survey=None, chunk=16, verbose=True):
+    """
+    exportBeams writes the AMISR-14 patterns of a list of beamcodes (default: all of BEAM-
+    FILE) to the cube FILENAME. Patterns found in ATLAS (a BeamAtlas or its file) are
+    copied, the others are computed. The atlas does not keep beamwidths: for one-way cubes
+    (JUST_RX) they are taken from SURVEY (a table written by Beam_Survey, one-way) when it
+    has the beam at FC; otherwise they are fitted on a window around the beam.
+
+    Return
+    ------
+    nbeams = The number of beams written.
+    """
+
+    if isinstance(atlas, str):
+        atlas = BeamAtlas(atlas)
+    cache = PatternCache(maxsize=1, atlas=atlas)
+
+    beamwidths = {}
+    if survey is not None and just_rx:
+        for row in readSurvey(survey, fc=fc):
+            beamwidths[int(row['code'])] = (row['hpbw_x'], row['hpbw_y'])
+
+    pointings = readBeamcodes(beamfile)
+    if codes is not None:
+        rows = dict(zip(pointings[:,0].astype(int).tolist(), range(pointings.shape[0])))
+        codes = [int(code, 16) if str(code).lower().startswith('0x') else int(code)
+                 for code in codes]
+        missing = [hex(code) for code in codes if code not in rows]
+        if len(missing) > 0:
+            raise ValueError("Beamcodes not found in %s: %s" % (beamfile, ", ".join(missing)))
+        pointings = pointings[[rows[code] for code in codes]]
+
+    attrs = {'maxphi':maxphi, 'nptsx':nptsx, 'nptsy':nptsy, 'fc':fc, 'just_rx':bool(just_rx),
+             'source':'AmisrPattern'}
+
+    t0 = time.time()
+    writer = None
+    try:
+        for ib, (code, azimuth, elevation) in enumerate(pointings[:,:3]):
+            pattern = cache.get(azimuth, elevation, maxphi=maxphi, nptsx=nptsx, nptsy=nptsy,
+                                fc=fc, just_rx=just_rx)
+            if int(code) not in beamwidths and pattern.beamwidth is None:
+                beamwidths[int(code)] = _beamWindow(azimuth, elevation, fc=fc,
+                                                    just_rx=just_rx).beamwidth
+            if writer is None:
+                writer = CubeWriter(filename, pattern.dcosx, pattern.dcosy, chunk=chunk,
+                                    attrs=attrs)
+            writer.write(pattern.norpattern, azimuth=azimuth, elevation=elevation, code=int(code),
+                         meanpos=pattern.meanpos, maxpattern=pattern.maxpattern,
+                         beamwidth=beamwidths.get(int(code), pattern.beamwidth))
+            if verbose and ((ib+1) % 500 == 0):
+                print("%d/%d beams (%.1f beams/s)" % (ib+1, pointings.shape[0],
+                                                      (ib+1)/(time.time()-t0)))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return 0 if writer is None else len(writer)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export AMISR-14 patterns to a chunked cube.')
+    parser.add_argument('filename', nargs='?', default='UMET_cube.npz')
+    parser.add_argument('--beamfile', default='UMET_beamcodes.csv')
+    parser.add_argument('--codes', default=None, help='comma-separated beamcodes (default all)')
+    parser.add_argument('--atlas', default=None)
+    parser.add_argument('--survey', default=None)
+    parser.add_argument('--maxphi', type=float, default=33)
+    parser.add_argument('--npts', type=int, default=101)
+    parser.add_argument('--fc', type=float, default=445)
+    parser.add_argument('--just-rx', action='store_true')
+    parser.add_argument('--chunk', type=int, default=16)
+    args = parser.parse_args()
+
+    codes = None if args.codes is None else args.codes.split(',')
+
+    t0 = time.time()
+    nbeams = exportBeams(args.filename, codes=codes, beamfile=args.beamfile, maxphi=args.maxphi,
+                         nptsx=args.npts, nptsy=args.npts, fc=args.fc, just_rx=args.just_rx,
+                         atlas=args.atlas, survey=args.survey, chunk=args.chunk)
+    print("%d beams written to %s in %.1f s" % (nbeams, args.filename, time.time()-t0))
@@ -0,0 +1,187 @@
+"""
+The module PATTERN_REGISTRY serves the predefined Jicamarca antenna configurations of PATTERNS from
+a compact table instead of running the select_pattern if-chain. The table (patterns_table.npz, next
+to this module) is compiled from patterns.py the first time it is needed and again whenever
+patterns.py changes; looking up a configuration is then one dictionary access.
+
+The table holds, one row per configuration ID:
+
+    ids     = configuration IDs
+    ues     = 4-elements ues (float64; uesint is 1 where select_pattern gives int64)
+    phase   = 8x8 phases
+    gaintx  = 8x8 Tx gains
+    gainrx  = 8x8 Rx gains
+    justrx  = just_rx flags
+    title   = titles
+
+and the SHA-1 of the patterns.py it was compiled from. select_pattern returns the same dictionary
+(values, types and dtypes) as patterns.select_pattern.
+
+MODULES CALLED:
+OS, AST, HASHLIB, NUMPY, PATTERNS (only to compile the table or read user files)
+"""
+
+import os
+import ast
+import hashlib
+import numpy
+
+
+registry_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patterns.py')
+registry_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patterns_table.npz')
+
+
+def _sourceDigest(source):
+    with open(source, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def patternIds(source=registry_source):
+    """
+    patternIds returns the sorted configuration IDs tested by the select_pattern if-chain of
+    SOURCE (pattern == N).
+    """
+
+    with open(source) as fp:
+        tree = ast.parse(fp.read())
+
+    ids = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Compare) and isinstance(node.left, ast.Name) and \
+           node.left.id == 'pattern' and isinstance(node.ops[0], ast.Eq):
+            value = node.comparators[0]
+            value = getattr(value, 'value', getattr(value, 'n', None))
+            if isinstance(value, int) and not isinstance(value, bool):
+                ids.add(value)
+    return sorted(ids)
+
+
+def buildRegistry(filename=registry_file, source=registry_source):
+    """
+    buildRegistry compiles every predefined configuration of SOURCE into the table FILENAME.
+
+    Return
+    ------
+    table = A dictionary of the table arrays (see module documentation).
+    """
+
+    import patterns
+
+    ids = patternIds(source)
+    setups = [patterns.select_pattern(pattern=pattern_id) for pattern_id in ids]
+
+    table = {'ids':numpy.array(ids, dtype='i8'),
+             'ues':numpy.array([setup['ues'] for setup in setups], dtype='f8'),
+             'uesint':numpy.array([numpy.asarray(setup['ues']).dtype.kind in 'iu'
+                                   for setup in setups], dtype='i1'),
+             'phase':numpy.array([setup['phase'] for setup in setups], dtype='f8'),
+             'gaintx':numpy.array([setup['gaintx'] for setup in setups], dtype='f8'),
+             'gainrx':numpy.array([setup['gainrx'] for setup in setups], dtype='f8'),
+             'justrx':numpy.array([setup['justrx'] for setup in setups], dtype='i8'),
+             'title':numpy.array([setup['title'] for setup in setups], dtype=str),
+             'digest':numpy.array(_sourceDigest(source))}
+
+    if filename is not None:
+        try:
+            numpy.savez_compressed(filename, **table)
+        except (IOError, OSError):
+            pass
+    return table
+
+
+class PatternRegistry():
+
+    def __init__(self, filename=registry_file, source=registry_source):
+        """
+        PatternRegistry gives O(1) access to the predefined configurations. Nothing is read
+        until the first lookup.
+
+        Examples
+        --------
+        >> registry = PatternRegistry()
+        >> setup = registry.get(2)
+        >> print setup['title']
+        """
+
+        self.filename = filename
+        self.source = source
+        self.__table = None
+        self.__rows = None
+
+    def __contains__(self, pattern_id):
+        self.__load()
+        return pattern_id in self.__rows
+
+    def __len__(self):
+        self.__load()
+        return len(self.__rows)
+
+    def ids(self):
+        """
+        ids returns the list of predefined configuration IDs.
+        """
+
+        self.__load()
+        return self.__table['ids'].tolist()
+
+    def get(self, pattern_id):
+        """
+        get returns the setup dictionary (ues, phase, gaintx, gainrx, justrx, title) of a
+        predefined configuration. Arrays are fresh copies, as from select_pattern. A Value-
+        Error is raised for an unknown ID.
+        """
+
+        self.__load()
+        irow = self.__rows.get(pattern_id)
+        if irow is None:
+            raise ValueError("Unknown JRO pattern ID: %s" % (pattern_id,))
+
+        table = self.__table
+        ues = table['ues'][irow].copy()
+        if table['uesint'][irow]:
+            ues = ues.astype('i8')
+
+        return {"ues":ues, "phase":table['phase'][irow].copy(), "gaintx":table['gaintx'][irow].copy(),
+                "gainrx":table['gainrx'][irow].copy(), "justrx":int(table['justrx'][irow]),
+                "title":str(table['title'][irow])}
+
+    def __load(self):
+        if self.__table is not None:
+            return
+
+        digest = _sourceDigest(self.source) if os.path.exists(self.source) else None
+        table = None
+        if self.filename is not None and os.path.exists(self.filename):
+            try:
+                with numpy.load(self.filename) as data:
+                    if digest is None or str(data['digest']) == digest:
+                        table = dict((name, data[name]) for name in data.files)
+            except (IOError, OSError, ValueError, KeyError):
+                table = None
+        if table is None:
+            table = buildRegistry(self.filename, self.source)
+
+        self.__table = table
+        self.__rows = dict(zip(table['ids'].tolist(), range(table['ids'].size)))
+
+
+registry = PatternRegistry()
+
+
+def select_pattern(path=None, filename=None, pattern=0):
+    """
+    select_pattern is a table-driven drop-in for patterns.select_pattern: predefined confi-
+    gurations come from the registry, user-defined ones (pattern=None) are read from the file
+    by patterns.select_pattern.
+
+    Examples
+    --------
+    >> setup = select_pattern(pattern=1)
+    >> setup = select_pattern(path="/users/users/Progs/Patterns/", filename="ExpSep232009.txt",
+    >>                        pattern=None)
+    """
+
+    if pattern is None:
+        import patterns
+        return patterns.select_pattern(path=path, filename=filename, pattern=None)
+    return registry.get(pattern)
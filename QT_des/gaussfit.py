@@ -32,3 +32,52 @@ def fitgaussian(data):
     p, success = optimize.leastsq(errorfunction, params)
     return p
 
+def quadfit(data, floor=0.1, niter=5):
+    """Returns (height, x, y, width_x, width_y)
+    the gaussian parameters of a 2D distribution without scipy.optimize.
+    log(data) is fitted to a separable quadratic by linear least squares
+    weighted by data (Guo's method) and the estimate is then refined with up
+    to niter Gauss-Newton steps using the analytic Jacobian of the gaussian,
+    halving a step until it lowers the residual. Samples below floor*max
+    are ignored in the log fit. Falls back to moments if the log fit does
+    not describe a peak."""
+    data = asarray(data, dtype=float)
+    X, Y = indices(data.shape)
+    good = isfinite(data) & (data > floor*nanmax(data))
+    if good.sum() < 5:
+        return moments(data)
+    z = data[good]
+    A = column_stack((ones(z.size), X[good], Y[good], X[good]**2, Y[good]**2))
+    a = linalg.lstsq(A*z[:,newaxis], z*log(z), rcond=None)[0]
+    if (a[3] >= 0) or (a[4] >= 0):
+        return moments(data)
+    p = array([exp(a[0] - a[1]**2/(4*a[3]) - a[2]**2/(4*a[4])),
+               -a[1]/(2*a[3]), -a[2]/(2*a[4]),
+               sqrt(-1/(2*a[3])), sqrt(-1/(2*a[4]))])
+
+    good = isfinite(data)
+    d = data[good]
+    x = X[good]
+    y = Y[good]
+    ex = (x - p[1])/p[3]
+    ey = (y - p[2])/p[4]
+    g = exp(-(ex**2 + ey**2)/2)
+    cost = ((d - p[0]*g)**2).sum()
+    for i in range(niter):
+        f = p[0]*g
+        J = column_stack((g, f*ex/p[3], f*ey/p[4], f*ex**2/p[3], f*ey**2/p[4]))
+        step = linalg.lstsq(J, d - f, rcond=None)[0]
+        for j in range(6):
+            q = p + step
+            if (q[0] > 0) and (q[3] > 0) and (q[4] > 0):
+                qx = (x - q[1])/q[3]
+                qy = (y - q[2])/q[4]
+                qg = exp(-(qx**2 + qy**2)/2)
+                qcost = ((d - q[0]*qg)**2).sum()
+                if qcost < cost:
+                    break
+            step = step/2
+        else:
+            break
+        p, ex, ey, g, cost = q, qx, qy, qg, qcost
+    return tuple(p)
@@ -37,11 +37,14 @@ from GUI_genExp_AMISR import *
 #sys.path.insert(1,'/home/soporte/app-amisr/realtime_web/volumes/app')
 #from app.utils import *
 import TimeTools
-from patterns import select_pattern
+from Pattern_Registry import select_pattern
 import Misc_Routines
 import Astro_Coords
 #from utils import gaussfit
 from plots import *
+from Pattern_Cache import PatternCache
+from Beam_Atlas import BeamAtlas
+from Beam_Footprint import CompositeFootprint
 from PIL import Image
 
 import matplotlib.pyplot as plt
@@ -69,9 +72,19 @@ class MatplotlibWidget(QMainWindow):
         self.ycos = []
         self.row_table = 25
         self.beams = []
+        ## PATRONES YA CALCULADOS
+        atlas = None
+        if os.path.exists(os.getcwd()+'/UMET_atlas.npy'):
+            atlas = BeamAtlas(os.getcwd()+'/UMET_atlas.npy')
+        self.patternCache = PatternCache(maxsize=32, atlas=atlas)
+        ## HUELLA COMPUESTA DEL EXPERIMENTO
+        self.footprint = CompositeFootprint(self.patternCache,
+                                            beamfile=os.getcwd()+'/UMET_beamcodes.csv')
+        self.footprintImage = None
         self.update_graph2()
         #Defaults parameters
         self.parameters_experiments_init()
+        self.update_footprint()
         #Components
         self.pushButton_refresh.clicked.connect(self.reset)
         self.pushButton_plot.clicked.connect(self.draw)
@@ -80,6 +93,7 @@ class MatplotlibWidget(QMainWindow):
         self.pushButton_addbeam.clicked.connect(self.add_button)
         self.pushButton_close.clicked.connect(self.salida)
         self.pushButton_send_exp.clicked.connect(self.send_exp)
+        self.lineEdit_SBeam.editingFinished.connect(self.update_footprint)
         
         self.addToolBar(NavigationToolbar(self.MplWidget.canvas, self))
         
@@ -218,6 +232,87 @@ class MatplotlibWidget(QMainWindow):
             b=b+","+i
 
         self.lineEdit_SBeam.setText(b[1:])
+        # A beamcode the footprint rejected has already been reported: no overlap for it.
+        if self.update_footprint() and len(self.beams) > 1:
+            self.PlotOverlap(self.beams)
+
+    def update_footprint(self):
+
+        sbeam = [i for i in self.lineEdit_SBeam.text().split(",") if len(i.strip()) > 0]
+        try:
+            # Schedule of GUI_genExp_AMISR: nTX = 0 fills the SYNC (PPS) interval with IPPs
+            # and the beam changes every IPP (bBeamProf = 0, nFFT = 1 in the generator).
+            sync  = float(self.lineEdit_PPS.text())*1000000
+            ipp   = float(self.lineEdit_IPP.text())
+            if ipp <= 0:
+                raise ValueError("IPP must be positive")
+            nIPPs = int(sync/ipp)
+            self.footprint.setSchedule(sbeam, nIPPs=nIPPs, nFFT=1, beamProf=False)
+        except ValueError as error:
+            print(error)
+            # Do not leave the footprint of the previous schedule on the map.
+            self.footprint.clear()
+            self.PlotFootprint()
+            self.MplWidget.canvas.draw()
+            # The dialog takes the focus: no second editingFinished while it is open.
+            self.lineEdit_SBeam.blockSignals(True)
+            QMessageBox.warning(self, "Beam footprint", str(error))
+            self.lineEdit_SBeam.blockSignals(False)
+            return False
+        self.PlotFootprint()
+        self.MplWidget.canvas.draw()
+        return True
+
+    def PlotFootprint(self):
+
+        ax = self.MplWidget.canvas.axes
+        if self.footprintImage is not None and self.footprintImage in ax.images:
+            self.footprintImage.remove()
+        self.footprintImage = None
+
+        amp = self.footprint.footprint
+        if amp is None:
+            return
+
+        x = self.footprint.dcosx
+        y = self.footprint.dcosy
+        dx = 0.5*(x[1] - x[0])
+        dy = 0.5*(y[1] - y[0])
+        power = 10*numpy.log10(numpy.maximum(amp/numpy.max(amp), 1e-30))
+        power = numpy.ma.masked_less(power, -20)
+        self.footprintImage = ax.imshow(power, extent=[x[0]-dx,x[-1]+dx,y[0]-dy,y[-1]+dy],
+                                        origin='lower', cmap='YlOrRd', vmin=-20, vmax=0,
+                                        alpha=0.35, aspect='auto', zorder=0)
+
+    def PlotOverlap(self, beams):
+
+        cwd = os.getcwd()
+        try:
+            overlap = beamOverlap(beams,path=cwd+'/UMET_beamcodes.csv')
+        except ValueError as error:
+            # An exception escaping a Qt slot aborts the application under PyQt5.
+            print(error)
+            QMessageBox.warning(self, "Beam overlap", str(error))
+            return
+
+        fig = plt.figure("Beam overlap")
+        fig.clear()
+        ax = fig.add_subplot(111)
+        im = ax.imshow(overlap,vmin=0,vmax=1,cmap='viridis',origin='upper')
+        ax.set_xticks(range(len(beams)))
+        ax.set_yticks(range(len(beams)))
+        ax.set_xticklabels(beams,rotation=90,fontsize=8)
+        ax.set_yticklabels(beams,fontsize=8)
+        if len(beams) <= 12:
+            for i in range(len(beams)):
+                for j in range(len(beams)):
+                    ax.text(j,i,"%.2f"%overlap[i,j],ha='center',va='center',fontsize=7,
+                            color='white' if overlap[i,j] < 0.5 else 'black')
+        fig.colorbar(im,ax=ax,label='Normalized overlap')
+        ax.set_title("Beam overlap (two-way power)")
+        fig.tight_layout()
+        fig.canvas.draw_idle()
+        plt.show(block=False)
 
     def salida(self):
         exit()
@@ -282,28 +377,32 @@ class MatplotlibWidget(QMainWindow):
         junklst = TimeTools.Julian(junkjd).change2lst(longitude=glon)
         ra_obs = junklst*15
 
-        ObjAnt = AmisrPattern(self.azimuth,
+        ObjAnt = self.patternCache.get(self.azimuth,
                             self.elevation,
                             maxphi=angle,
                             nptsx=nptsx,
                             nptsy=nptsy,
-                            just_rx=False)
+                            just_rx=False,
+                            zoom=True)
         # self.MplWidget.canvas.axes = self.MplWidget.canvas.axes()
 
         self.PlotApuntes(jd=junkjd,ra_obs=ra_obs,xg=xg, yg=yg,x=ObjAnt.dcosx,y=ObjAnt.dcosy,
                         allAmisr_x=fullDCOSX,allAmisr_y=fullDCOSY)
         self.PlotPatronRa(amp=ObjAnt.norpattern,x=ObjAnt.dcosx,y=ObjAnt.dcosy,
-                    getCut=ObjAnt.getcut,title=ptitle)
+                    getCut=ObjAnt.getcut,title=ptitle,patches=ObjAnt.patches,
+                    isolines=ObjAnt.isolines)
 
         self.PlotBfield(self.fecha, heights=self.high)
         
         self.PlotPatronRa(amp=ObjAnt.norpattern,x=ObjAnt.dcosx,y=ObjAnt.dcosy,
-                    getCut=ObjAnt.getcut,title=ptitle)
+                    getCut=ObjAnt.getcut,title=ptitle,patches=ObjAnt.patches,
+                    isolines=ObjAnt.isolines)
 
         self.PlotBfield(self.fecha, heights=self.high)
 
         if plot == True:
             self.only_points(self.xcos,self.ycos)
+        self.PlotFootprint()
         self.MplWidget.canvas.mpl_connect('button_press_event', self.on_click)
 
         if self.MplWidget.canvas.axes.can_zoom():
@@ -403,11 +502,22 @@ class MatplotlibWidget(QMainWindow):
         print("")
 ##########################################################################################################
 ##########################################################################################################
-    def PlotPatronRa(self, amp=None,x=None,y=None,getCut=None,title=""):
+    def PlotPatronRa(self, amp=None,x=None,y=None,getCut=None,title="",patches=None,isolines=None):
     
         if getCut == 1:
             return
 
+        # Refined patches (AmisrPattern.getZoom) replace the coarse samples lying more than
+        # one coarse step inside them, so both sets of contours join without a gap.
+        if patches and self.site != 1 and isolines is None:
+            amp = numpy.array(amp,dtype=float)
+            dx = x[1] - x[0]
+            dy = y[1] - y[0]
+            for pamp,px,py in patches:
+                inx = (x > px[0] + dx) & (x < px[-1] - dx)
+                iny = (y > py[0] + dy) & (y < py[-1] - dy)
+                amp[numpy.ix_(iny,inx)] = numpy.nan
+
         xmax = numpy.max(x)
         xmin = numpy.min(x)
         ymax = numpy.max(y)
@@ -424,17 +534,23 @@ class MatplotlibWidget(QMainWindow):
         #colorgrid = (1.,109/255.,0)
 
         colors = ((0,0,1.),(0,170/255.,0),(127/255.,1.,0),(1.,109/255.,0),(128/255.,0,0))
-        if self.site== 1:
-            CS = self.MplWidget.canvas.axes.contour(x,y,amp.transpose(),levels,colors=colors)
+        # Isolines stored with the pattern are drawn directly, without contour extraction.
+        if isolines is not None:
+            drawIsolines(self.MplWidget.canvas.axes,isolines,levels=levels,colors=colors)
         else:
-            CS = self.MplWidget.canvas.axes.contour(x,y,amp,levels,colors=colors)
-        fmt = {}
-        for l,s in zip(CS.levels,labels):
-            fmt[l] = s
+            if self.site== 1:
+                CS = self.MplWidget.canvas.axes.contour(x,y,amp.transpose(),levels,colors=colors)
+            else:
+                CS = self.MplWidget.canvas.axes.contour(x,y,amp,levels,colors=colors)
+                for pamp,px,py in (patches or []):
+                    self.MplWidget.canvas.axes.contour(px,py,pamp,levels,colors=colors)
+            fmt = {}
+            for l,s in zip(CS.levels,labels):
+                fmt[l] = s
+            self.MplWidget.canvas.axes.clabel(CS,CS.levels,inline=True,fmt=fmt,fontsize=10)
 
         
         self.MplWidget.canvas.axes.annotate(self.mesg,xy=(0,0),xytext=(0.01,0.01),xycoords='figure fraction')
-        self.MplWidget.canvas.axes.clabel(CS,CS.levels,inline=True,fmt=fmt,fontsize=10)
         self.MplWidget.canvas.axes.set_xlim(xmin,xmax)
         self.MplWidget.canvas.axes.set_ylim(ymin,ymax)
         self.MplWidget.canvas.axes.set_title("Total Pattern: " + title)
@@ -6,7 +6,11 @@ import scipy
 import base64
 import datetime
 import scipy.interpolate
+import scipy.fft
+import scipy.signal
+import scipy.ndimage
 import math
+import tracemalloc
 
 
 #from .muf import *
@@ -16,7 +20,7 @@ import TimeTools
 import Astro_Coords
 import Misc_Routines
 from matplotlib.figure import Figure
-from patterns import select_pattern
+from Pattern_Registry import select_pattern
 import matplotlib.pyplot as plt
 from PIL import Image
 
@@ -38,6 +42,63 @@ attenuation = numpy.array([[[-21.25,-15.25,-9.25,-3.25,3.25,9.25,15.25,21.25],
 		         [-15.25,-15.25,-15.25,-15.25,-15.25,-15.25,-15.25,-15.25],
     		         [-21.25,-21.25,-21.25,-21.25,-21.25,-21.25,-21.25,-21.25]]])
 
+# Contour levels (normalized power) and colors of the pattern maps.
+isoline_levels = numpy.array([1e-3,1e-2,1e-1,0.5,1.0])
+isoline_colors = ((0,0,1.),(0,170/255.,0),(127/255.,1.,0),(1.,109/255.,0),(128/255.,0,0))
+
+# Jro_Library.JroLibrary objects opened by jroLibrary, by file name.
+jro_libraries = {}
+
+# Real and complex dtypes used by the pattern engines for each precision mode.
+precision_dtypes = {'double':(numpy.float64, numpy.complex128), 'single':(numpy.float32, numpy.complex64)}
+
+# AMISR-14 geometry (meters): panel centres (x, y) and the 32 element positions inside
+# a panel. Both sets are separable in x and y, which the array-factor kernel exploits.
+amisr_panelpos = numpy.array([[-9.90000000e-01,  9.90000000e-01, -9.90000000e-01,
+                                9.90000000e-01, -9.90000000e-01,  9.90000000e-01,
+                               -9.90000000e-01,  9.90000000e-01, -9.90000000e-01,
+                                9.90000000e-01, -9.90000000e-01,  9.90000000e-01,
+                               -9.90000000e-01,  9.90000000e-01],
+                              [-1.04100000e+01, -1.04100000e+01, -6.94000000e+00,
+                               -6.94000000e+00, -3.47000000e+00, -3.47000000e+00,
+                               -1.77635684e-15, -1.77635684e-15,  3.47000000e+00,
+                                3.47000000e+00,  6.94000000e+00,  6.94000000e+00,
+                                1.04100000e+01,  1.04100000e+01]])
+
+amisr_xypos = numpy.asarray([[ 0.        ,  0.        ],
+                             [-0.15802247,  0.43434   ],
+                             [ 0.        ,  0.86868   ],
+                             [-0.15802247,  1.30302   ],
+                             [ 0.        ,  1.73736   ],
+                             [-0.15802247,  2.1717    ],
+                             [ 0.        ,  2.60604   ],
+                             [-0.15802247,  3.04038   ],
+                             [ 0.495808  ,  0.        ],
+                             [ 0.33778553,  0.43434   ],
+                             [ 0.495808  ,  0.86868   ],
+                             [ 0.33778553,  1.30302   ],
+                             [ 0.495808  ,  1.73736   ],
+                             [ 0.33778553,  2.1717    ],
+                             [ 0.495808  ,  2.60604   ],
+                             [ 0.33778553,  3.04038   ],
+                             [ 0.991616  ,  0.        ],
+                             [ 0.83359353,  0.43434   ],
+                             [ 0.991616  ,  0.86868   ],
+                             [ 0.83359353,  1.30302   ],
+                             [ 0.991616  ,  1.73736   ],
+                             [ 0.83359353,  2.1717    ],
+                             [ 0.991616  ,  2.60604   ],
+                             [ 0.83359353,  3.04038   ],
+                             [ 1.487424  ,  0.        ],
+                             [ 1.32940153,  0.43434   ],
+                             [ 1.487424  ,  0.86868   ],
+                             [ 1.32940153,  1.30302   ],
+                             [ 1.487424  ,  1.73736   ],
+                             [ 1.32940153,  2.1717    ],
+                             [ 1.487424  ,  2.60604   ],
+                             [ 1.32940153,  3.04038   ]])
+
+
 class BField():
     def __init__(self,year=None,doy=None,site=1,heights=None,alpha_i=90):
         """
@@ -546,7 +607,7 @@ class AntPatternPlot:
             self.fig = Figure(figsize=(8,8), facecolor='white')
             self.ax  = self.fig.add_subplot(111)
 
-    def contPattern(self,site=1, iplot=0,gpath='',filename='',mesg='',amp=None ,x=None ,y=None ,getCut=None,title='', save=False):
+    def contPattern(self,site=1, iplot=0,gpath='',filename='',mesg='',amp=None ,x=None ,y=None ,getCut=None,title='', save=False, isolines=None):
         """
         contPattern plots a contour map of the antenna pattern.
 
@@ -554,6 +615,8 @@ class AntPatternPlot:
         ----------
         iplot = A integer to specify if the plot is  the first, second, ...  The default va-
           lue is 0.
+        isolines = Precomputed isolines (see patternIsolines). If given they are drawn as
+          line collections and no contour is extracted.
 
         Examples
         --------
@@ -581,17 +644,20 @@ class AntPatternPlot:
 
 
         colors = ((0,0,1.),(0,170/255.,0),(127/255.,1.,0),(1.,109/255.,0),(128/255.,0,0))
-        if site== 1:
-            CS = self.ax.contour(x,y,amp.transpose(),levels,colors=colors)
+        if isolines is not None:
+            drawIsolines(self.ax,isolines,levels=levels,colors=colors)
         else:
-            CS = self.ax.contour(x,y,amp,levels,colors=colors)
-        fmt = {}
-        for l,s in zip(CS.levels,labels):
-            fmt[l] = s
+            if site== 1:
+                CS = self.ax.contour(x,y,amp.transpose(),levels,colors=colors)
+            else:
+                CS = self.ax.contour(x,y,amp,levels,colors=colors)
+            fmt = {}
+            for l,s in zip(CS.levels,labels):
+                fmt[l] = s
+            self.ax.clabel(CS,CS.levels,inline=True,fmt=fmt,fontsize=10)
 
         
         self.ax.annotate(mesg,xy=(0,0),xytext=(0.01,0.01),xycoords='figure fraction')
-        self.ax.clabel(CS,CS.levels,inline=True,fmt=fmt,fontsize=10)
         self.ax.set_xlim(xmin,xmax)
         self.ax.set_ylim(ymin,ymax)
         self.ax.set_title("Total Pattern: " + title)
@@ -996,8 +1062,13 @@ class PatternCutPlot:
 
 
 class JroPattern():
+
+    # Pruned-DFT matrices of the FFT method (see __fftPlan), shared by every object.
+    fftPlans = {}
+    fftPlansSize = 8
+
     def __init__(self,pattern=0,path=None,filename=None,nptsx=101,nptsy=101,maxphi=5,fftopt=0, \
-        getcut=0,dcosx=[],dcosy=[],eomwl=6,airwl=4, **kwargs):
+        getcut=0,dcosx=[],dcosy=[],eomwl=6,airwl=4,exact=False,precision='double', **kwargs):
         """
         JroPattern class creates an object to represent the useful parameters for beam mode-
         lling of the Jicamarca VHF radar.
@@ -1028,6 +1099,13 @@ class JroPattern():
         eomwl = A scalar giving the radar wavelength. The default value is 6m (50 MHZ).
         airwl = Set this input to float (or intger) to specify the wavelength (in meters) of
           the transmitted EOM wave in the air. The default value is 4m.
+        exact = Set to True to estimate the main-beam parameters with the iterative Gaussian
+          least-squares fit. The default (False) uses the closed-form estimator (see _get-
+          BeamPars).
+        precision = Set to 'single' to compute the pattern in float32/complex64, halving the
+          memory footprint. The default value is 'double'. In single precision norpattern
+          differs from double by less than 1e-5 (absolute, i.e. below -50 dB)  and meanpos
+          by less than 1e-5.
 
         Modification History
         --------------------
@@ -1089,8 +1167,13 @@ class JroPattern():
 
         self.kk = 2.*numpy.pi/eomwl
 
+        self.exact = exact
+        self.precision = precision
+        self.rdtype, self.cdtype = precision_dtypes[precision]
+
         self.pattern = None
         self.meanpos = None
+        self.beamwidth = None
         self.norpattern = None
         self.maxpattern = None
 
@@ -1124,17 +1207,22 @@ class JroPattern():
             #print  "To get a cut of the antenna pattern uses ffopt=0"
             return None, None
 
+        # Tx and Rx patterns are the same when their configurations are.
+        sametxrx = numpy.array_equal(self.uestx,self.uesrx) and \
+                   numpy.array_equal(self.phasetx,self.phaserx) and \
+                   numpy.array_equal(self.gaintx,self.gainrx)
+
         if (self.fftopt==0):
             # Getting antenna pattern using the array method
             self.pattern = self.__usingArray(rx=1)
             if (self.justrx==0):
-                self.pattern = self.pattern*self.__usingArray(rx=0)
+                self.pattern = self.pattern*(self.pattern if sametxrx else self.__usingArray(rx=0))
 
         elif (self.fftopt>0):
             # Getting antenna pattern using FFT method
             self.pattern = self.__usingFFT(rx=1)
             if (self.justrx==0):
-                self.pattern = self.pattern*self.__usingFFT(rx=0)
+                self.pattern = self.pattern*(self.pattern if sametxrx else self.__usingFFT(rx=0))
 
         self.maxpattern = numpy.nanmax(self.pattern)
         self.norpattern = self.pattern/self.maxpattern
@@ -1199,6 +1287,14 @@ class JroPattern():
 
         pattern = iFFT(FFT(gain*EXP(j*phase)))
 
+        The aperture is an 8x8 grid of modules, each one 11x11 cells of constant gain*EXP(j*
+        phase), placed on a 2048x2048 half-wavelength grid. Only the bins inside the pattern
+        window are needed, so instead of the full transform the DFT is evaluated directly at
+        (dcosx, dcosy): per axis the cells of a module are summed into a (npts, 8) matrix (see
+        __fftPlan) and the pattern is Bx @ weights @ By^T. At FFT bins this equals the crop-
+        ped FFT. As in the array method, the columns of the module matrices run along x and
+        the rows along -y, and the output is on the grid of the object, (nx, ny).
+
         Parameters
         ----------
         rx = Set to 1 to use the Rx information. Otherwise set to 0 for Tx.
@@ -1240,41 +1336,49 @@ class JroPattern():
 
         nxfft = 2048
         nyfft = 2048
-        dcosx = (numpy.arange(nxfft) - (0.5*nxfft))/(nxfft*delta_x)*self.eomwl
-        dcosy = (numpy.arange(nyfft) - (0.5*nyfft))/(nyfft*delta_y)*self.eomwl
-
-        fft_gain = numpy.zeros((nxfft,nyfft))
-        fft_phase = numpy.zeros((nxfft,nyfft))
 
         nx = 8
         ny = 8
         ndx =12
         ndy =12
-        for iy in numpy.arange(ny):
-            for ix in numpy.arange(nx):
-                ix1 = nxfft/2-self.nx/2*ndx+ix*ndx
-                if ix<(nx/2):ix1 = ix1 - 1
-                if ix>=(nx/2):ix1 = ix1 + 1
-
-                iy1 = nyfft/2-ny/2*ndx+iy*ndy
-                if iy<(ny/2):iy1 = iy1 - 1
-                if iy>=(ny/2):iy1 = iy1 + 1
 
-                fft_gain[ix1:ix1+ndx-1,iy1:iy1+ndy-1] = gain[ix,ny-1-iy]
-                fft_phase[ix1:ix1+ndx-1,iy1:iy1+ndy-1] = phase[ix,ny-1-iy]
+        # Module (i,j) sits at x column j and y row i, with y decreasing along i (as posx and
+        # posy of the array method). The plans give EXP(-j*k*pos*dcos): x is mirrored to get
+        # the +j*k*posx of the array method, y already is (posy = -pos). Mirroring an axis
+        # only shifts the aperture by a constant, a phase that |.|**2 drops.
+        phase = phase*Misc_Routines.CoFactors.d2r
+        wgts = (gain*numpy.exp(1j*phase))[:,::-1].T.astype(self.cdtype)
 
+        Bx = self.__fftPlan(nxfft,nx,ndx,delta_x,self.dcosx)
+        By = self.__fftPlan(nyfft,ny,ndy,delta_y,self.dcosy)
 
-        fft_phase = fft_phase*Misc_Routines.CoFactors.d2r
+        pattern = numpy.abs(numpy.dot(numpy.dot(Bx,wgts),By.T))**2
 
-        pattern = numpy.abs(numpy.fft.fft2(fft_gain*numpy.exp(numpy.complex(0,1)*fft_phase)))**2
-        pattern = numpy.fft.fftshift(pattern)
+        return pattern
 
-        xvals = numpy.where((dcosx>=(numpy.min(self.dcosx))) & (dcosx<=(numpy.max(self.dcosx))))
-        yvals = numpy.where((dcosy>=(numpy.min(self.dcosy))) & (dcosy<=(numpy.max(self.dcosy))))
+    def __fftPlan(self,nfft,nmod,ndm,delta,dcos):
+        """
+        __fftPlan returns the (npts, nmod) matrix that evaluates, at the directional cosines
+        DCOS, the NFFT-point DFT of an aperture axis made of NMOD modules of ndm-1 cells. The
+        matrices are computed in double precision, rounded to the selected precision and kept
+        in JroPattern.fftPlans.
+        """
 
-        pattern = pattern[xvals[0][0]:xvals[0][-1],yvals[0][0]:yvals[0][-1]]
-
-        return pattern
+        dcos = numpy.asarray(dcos,dtype=float)
+        key = (nfft,nmod,ndm,delta/self.eomwl,dcos.tobytes(),numpy.dtype(self.cdtype).str)
+        plan = JroPattern.fftPlans.pop(key,None)
+        if plan is None:
+            imod = numpy.arange(nmod)
+            start = nfft//2 - nmod//2*ndm + imod*ndm + numpy.where(imod<(nmod/2),-1,1)
+            cells = start[:,None] + numpy.arange(ndm-1)[None,:]
+            # dcos = k/(nfft*delta)*eomwl at shifted bin k, i.e. k/nfft = dcos*delta/eomwl.
+            freq = dcos*delta/self.eomwl
+            plan = numpy.exp(-2j*numpy.pi*numpy.multiply.outer(freq,cells)).sum(axis=2)
+            plan = plan.astype(self.cdtype)
+            while len(JroPattern.fftPlans)>=self.fftPlansSize:
+                JroPattern.fftPlans.pop(next(iter(JroPattern.fftPlans)))
+        JroPattern.fftPlans[key] = plan
+        return plan
 
 
     def __dipPattern(self,ar,nr,lr):
@@ -1301,28 +1405,30 @@ class JroPattern():
         Converted to Python by Freddy R. Galindo, ROJ, 20 September 2009.
         """
 
-        dipole = numpy.zeros((self.nx,self.ny),dtype=complex)
-        for iy in range(self.ny):
-            for ix in range(self.nx):
-                yindex = iy*(self.getcut==0) + ix*(self.getcut==1)
+        # The pattern is separable: one (real) factor along x and one along y. The factors
+        # are rounded to the selected precision before the grid-sized product.
+        junkx = self.__sincRatio(ar[0,0],nr[0,0],lr[0,0],self.dcosx).astype(self.rdtype)
 
-                argx = ar[0,0]*self.dcosx[ix] - lr[0,0]
-                if argx == 0.0:    
-                    junkx = nr[0,0]
-                else:
-                    junkx = numpy.sin(0.5*self.kk*nr[0,0]*argx)/numpy.sin(0.5*self.kk*argx)
-                
+        if self.getcut==0:
+            junky = self.__sincRatio(ar[1,0],nr[1,0],lr[1,0],self.dcosy).astype(self.rdtype)
+            dipole = numpy.multiply.outer(junkx,junky)
+        else:
+            # Cut: point ix is (dcosx[ix], dcosy[ix]).
+            junky = self.__sincRatio(ar[1,0],nr[1,0],lr[1,0],self.dcosy[:self.nx])
+            dipole = (junkx*junky.astype(self.rdtype))[:,None]
 
-                argy = ar[1,0]*self.dcosy[yindex] - lr[1,0]
-                if argy == 0.0: 
-                    junky = nr[1,0]
-                else:
-                    junky = numpy.sin(0.5*self.kk*nr[1,0]*argy)/numpy.sin(0.5*self.kk*argy)
-                
+        return dipole
 
-                dipole[ix,iy] = junkx*junky
+    def __sincRatio(self,a0,n0,l0,dcos):
+        """
+        __sincRatio returns SIN(k/2*n0*arg)/SIN(k/2*arg), arg = a0*dcos - l0, for an array
+        of directional cosines. The limit n0 is used where arg is 0.
+        """
 
-        return dipole
+        arg = a0*numpy.asarray(dcos,dtype=float) - l0
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            junk = numpy.sin(0.5*self.kk*n0*arg)/numpy.sin(0.5*self.kk*arg)
+        return numpy.where(arg==0.0,n0,junk)
 
     def __modPattern(self,phase,gain):
         """
@@ -1355,20 +1461,47 @@ class JroPattern():
         posy = pos[1,:,:]
 
         phase = phase*Misc_Routines.CoFactors.d2r
-        module = numpy.zeros((self.nx,self.ny),dtype=complex)
-        for iy in range(self.ny):
-            for ix in range(self.nx):
-                yindex = iy*(self.getcut==0) + ix*(self.getcut==1)
-                phasex = posx*self.dcosx[ix]
-                phasey = posy*self.dcosy[yindex]
-                tmp = gain*numpy.exp(numpy.complex(0,1.)*(self.kk*(phasex+phasey)+phase))
-                module[ix,iy] = tmp.sum()
+        wgts = (gain*numpy.exp(1j*phase)).astype(self.cdtype)
+
+        dcosx = numpy.asarray(self.dcosx,dtype=float)
+        dcosy = numpy.asarray(self.dcosy,dtype=float)[:self.nx] if self.getcut==1 else \
+                numpy.asarray(self.dcosy,dtype=float)
+
+        if numpy.all(posx==posx[:1,:]) and numpy.all(posy==posy[:,:1]):
+            # posx only varies along columns and posy along rows, so the sum factors into
+            # module = Ex @ wgts^T @ Ey^T, Ex = EXP(j*k*dcosx*posx), Ey = EXP(j*k*dcosy*posy).
+            # Phases are formed in double precision; only the (npts, 8) tables are rounded.
+            Ex = numpy.exp(1j*self.kk*numpy.multiply.outer(dcosx,posx[0,:])).astype(self.cdtype)
+            Ey = numpy.exp(1j*self.kk*numpy.multiply.outer(dcosy,posy[:,0])).astype(self.cdtype)
+            if self.getcut==0:
+                module = numpy.dot(numpy.dot(Ex,wgts.T),Ey.T)
+            else:
+                module = numpy.sum(numpy.dot(Ex,wgts.T)*Ey,axis=1)[:,None]
+        else:
+            # General layout: accumulate one module at a time over the whole grid.
+            dcosx = dcosx.astype(self.rdtype)
+            dcosy = dcosy.astype(self.rdtype)
+            if self.getcut==0:
+                dcosx, dcosy = dcosx[:,None], dcosy[None,:]
+            else:
+                dcosx, dcosy = dcosx[:,None], dcosy[:,None]
+            module = 0
+            for wgt, px, py in zip(wgts.ravel(),posx.ravel(),posy.ravel()):
+                module = module + wgt*numpy.exp(1j*self.kk*(px*dcosx + py*dcosy))
 
         return module
 
     def __getBeamPars(self):
         """
-        _getBeamPars computes the main-beam parameters of the antenna.
+        _getBeamPars computes the main-beam parameters of the antenna (meanpos and the half-
+        power beamwidth, in degrees, along x and y).
+
+        A gaussian is fitted to the main beam. By default gaussfit.quadfit is used: a closed-
+        form log-quadratic estimate refined by a few analytic Gauss-Newton steps. For a sin-
+        gle, gaussian-shaped lobe above half power, sampled by at least 3 points per axis, it
+        agrees with the least-squares fit (exact=True, gaussfit.fitgaussian) within 1e-5 in
+        meanpos and 1e-4 (relative) in width. The two fits differ for split or non-gaussian
+        main beams (e.g. JRO patterns 22, 146, 322), where exact=True should be used.
 
         Modification history
         --------------------
@@ -1381,12 +1514,13 @@ class JroPattern():
 
         amp = self.norpattern
 
-        xx =  numpy.resize(self.dcosx,(self.nx,self.nx)).transpose()
-        yy =  numpy.resize(self.dcosy,(self.ny,self.ny))
+        xx =  numpy.broadcast_to(self.dcosx[:,None],amp.shape)
+        yy =  numpy.broadcast_to(self.dcosy[None,:],amp.shape)
 
-        mm0 = amp[numpy.where(amp > 0.5)]
-        xx0 = xx[numpy.where(amp > 0.5)]
-        yy0 = yy[numpy.where(amp > 0.5)]
+        main = numpy.where(amp > 0.5)
+        mm0 = amp[main]
+        xx0 = xx[main]
+        yy0 = yy[main]
 
         xc = numpy.sum(mm0*xx0)/numpy.sum(mm0)
         yc = numpy.sum(mm0*yy0)/numpy.sum(mm0)
@@ -1401,7 +1535,10 @@ class JroPattern():
 
         # fitting data into the main beam.
         
-        params = gaussfit.fitgaussian(mm1)
+        if self.exact:
+            params = gaussfit.fitgaussian(mm1)
+        else:
+            params = gaussfit.quadfit(mm1)
 
         # Tranforming from indexes to axis' values
         xcenter = xx1[0] + (((xx1[xx1.size-1] - xx1[0])/(xx1.size -1))*(params[1]))
@@ -1416,15 +1553,69 @@ class JroPattern():
         #print  'BWHP:     %f' %(2*numpy.sqrt(2*meanwx)*numpy.sqrt(-numpy.log(0.5)))
 
         self.meanpos = meanpos
+        self.beamwidth = 2*numpy.sqrt(-2*numpy.log(0.5))*numpy.array([xwidth,ywidth])
 
 class AmisrPattern():
 
+    # Precomputed unsteered array-factor tables used when shiftopt=1 (see __shiftedPattern).
+    # maxsteer is the largest |Cx0|,|Cy0| covered by the tables (cos(40 deg)).
+    steerCache = {}
+    steerCacheSize = 4
+    maxsteer = numpy.cos(40*Misc_Routines.CoFactors.d2r)
+
     def __init__(self,azimuth=0, elevation=90,filename=None,nptsx=101,nptsy=101,maxphi=40,\
-                dcosx=[],dcosy=[], fc=445, just_rx=False):
+                dcosx=[],dcosy=[], fc=445, just_rx=False, shiftopt=0, oversample=2, exact=False,\
+                precision='double', maxbytes=None, out=None, fftopt=0, compute=True):
         """
         AMISR-14 class creates an object to represent the useful parameters for beam mode-
         lling of the Jicamarca VHF radar.
 
+        Parameters
+        ----------
+        azimuth = A scalar giving the azimuth (in degrees) of the steered beam.
+        elevation = A scalar giving the elevation (in degrees) of the steered beam.
+        nptsx = A scalar to specify the number of points  used to define the angular resolu-
+          tion in the "x" axis. The default value is 101.
+        nptsy = A scalar to specify the number of points  used to define the angular resolu-
+          tion in the "y" axis. The default value is 101.
+        maxphi = A scalar giving the maximum (absolute) angle (in degree) to model the ante-
+          nna pattern. The default value is 40 degrees.
+        fc = A scalar giving the radar frequency in MHz. The default value is 445.
+        just_rx = Set to True to model only the Rx pattern. Otherwise the two-way pattern is
+          returned.
+        shiftopt = Set this input to 1 to steer the beam by shifting an unsteered array fac-
+          tor precomputed once per grid (see __shiftedPattern). Set to 0 (default value) to
+          evaluate the array factor directly.
+        oversample = An integer giving the oversampling of the precomputed array factor with
+          respect to the output grid. SHIFTOPT must be actived. The default value is 2.
+        exact = Set to True to estimate the main-beam parameters with the iterative Gaussian
+          least-squares fit. The default (False) uses the closed-form estimator (see _get-
+          BeamPars).
+        precision = Set to 'single' to compute the pattern in float32/complex64, halving the
+          memory footprint and traffic of the grids. The default value is 'double'. In sin-
+          gle precision norpattern differs from double by less than 1e-5 (absolute,  i.e.
+          below -50 dB, enough for contours at -30 to 0 dB) and meanpos by less than 1e-5.
+        maxbytes = A scalar giving a memory budget (in bytes) for the temporaries. If set, the
+          pattern is computed in blocks of rows (see __tiledPattern) and the peak memory used
+          is stored in the attribute peakmemory; SHIFTOPT is then ignored. The default value
+          is None (whole grid at once).
+        out = An array (nptsy,nptsx), e.g. a numpy.memmap, where the normalized pattern is
+          written when MAXBYTES is set. The default value is None (a new array).
+        fftopt = Set this input to 1 to evaluate the array factors on uniform grids with chirp-
+          z transforms (see __cztArrayFactor). To evaluate the direct sum set to 0 (default
+          value).
+        compute = Set to False to skip getPattern: the object then only holds the pointing
+          and the default panels and weights, e.g. to refine a precomputed pattern with
+          getZoom(coarse=...). The default value is True.
+
+        Examples
+        --------
+        >> out = numpy.lib.format.open_memmap('amisr_2001.npy', mode='w+', dtype=numpy.float32,
+               shape=(2001,2001))
+        >> ObjAnt = AmisrPattern(30, 70, maxphi=33, nptsx=2001, nptsy=2001, precision='single',
+               maxbytes=64*1024**2, out=out)
+        >> print ObjAnt.peakmemory
+
         Modification History
         --------------------
         Writen by Joab Apaza, ROJ, July 2023.
@@ -1450,7 +1641,19 @@ class AmisrPattern():
         self.nx = dcosx.size
         self.ny = dcosy.size*(self.getcut==0) + (self.getcut==1)
 
-        self.Cx, self.Cy = numpy.meshgrid(dcosx, dcosy)
+        self.precision = precision
+        self.rdtype, self.cdtype = precision_dtypes[precision]
+
+        self.maxbytes = maxbytes
+        self.out = out
+        self.peakmemory = None
+
+        if self.maxbytes is None:
+            self.Cx, self.Cy = numpy.meshgrid(dcosx.astype(self.rdtype), dcosy.astype(self.rdtype))
+        else:
+            # Read-only views, no full grids are allocated in tiled mode.
+            self.Cx = numpy.broadcast_to(dcosx.astype(self.rdtype)[None,:], (self.ny, self.nx))
+            self.Cy = numpy.broadcast_to(dcosy.astype(self.rdtype)[:,None], (self.ny, self.nx))
         self.Cx0 = numpy.cos(numpy.radians(elevation))*numpy.sin(numpy.radians(azimuth))
         self.Cy0 = numpy.cos(numpy.radians(elevation))*numpy.cos(numpy.radians(azimuth))
 
@@ -1458,14 +1661,27 @@ class AmisrPattern():
 
         self.kk = 2.*numpy.pi/self.eomwl
 
+        self.shiftopt = shiftopt
+        self.fftopt = fftopt
+        self.oversample = int(oversample)
+        self.exact = exact
+
+        self.__field = None
+        self.patches = None
+        self.isolines = None
+
         self.pattern = None
         self.meanpos = None
+        self.beamwidth = None
         self.norpattern = None
         self.maxpattern = None
 
-        
-
-        self.getPattern()
+        if compute:
+            self.getPattern()
+        else:
+            self.xpos = numpy.asarray(amisr_panelpos[0], dtype=float)
+            self.ypos = numpy.asarray(amisr_panelpos[1], dtype=float)
+            self.wgts = numpy.ones(len(self.xpos))
 
     def getPattern(self, xy_panelPos=[], wgts=[]):
         """
@@ -1480,39 +1696,255 @@ class AmisrPattern():
         --------------------
         Writen by Joab Apaza, ROJ, July 2023.
         """
-        panelPos = numpy.array([[-9.90000000e-01,  9.90000000e-01, -9.90000000e-01,
-         9.90000000e-01, -9.90000000e-01,  9.90000000e-01,
-        -9.90000000e-01,  9.90000000e-01, -9.90000000e-01,
-         9.90000000e-01, -9.90000000e-01,  9.90000000e-01,
-        -9.90000000e-01,  9.90000000e-01],
-       [-1.04100000e+01, -1.04100000e+01, -6.94000000e+00,
-        -6.94000000e+00, -3.47000000e+00, -3.47000000e+00,
-        -1.77635684e-15, -1.77635684e-15,  3.47000000e+00,
-         3.47000000e+00,  6.94000000e+00,  6.94000000e+00,
-         1.04100000e+01,  1.04100000e+01]])
         
         if len(xy_panelPos)>0:
             xpos = xy_panelPos[0]
             ypos = xy_panelPos[1]
 
         else:
-            xpos = panelPos[0]
-            ypos = panelPos[1]
+            xpos = amisr_panelpos[0]
+            ypos = amisr_panelpos[1]
         
         if len(wgts)<1:
             wgts = numpy.ones(len(xpos))
 
-        panel = self.__modPattern()
+        self.xpos = numpy.asarray(xpos, dtype=float)
+        self.ypos = numpy.asarray(ypos, dtype=float)
+        self.wgts = numpy.asarray(wgts)
+        self.__field = None
 
-        farr = 0
-        for i in range(len(xpos)):
+        if self.maxbytes is not None:
+            self.__tiledPattern(xpos, ypos, wgts)
+            return
 
-            farr += wgts[i]*numpy.exp( 1j*self.kk*(xpos[i]*(self.Cx-self.Cx0) + ypos[i]*(self.Cy-self.Cy0)))
+        if self.shiftopt>0 and self.__isUniform():
+            pattern = self.__shiftedPattern(xpos, ypos, wgts)
+        else:
+            panel = self.__modPattern()
 
-        #antenna pattern
-        self.pattern = abs(farr*panel)**2
-        
+            farr = self.__arrayFactor(xpos, ypos, wgts)
+
+            #antenna pattern
+            pattern = numpy.abs(farr*panel)**2
+
+        self.__setPattern(pattern)
+
+    def setWeights(self, panels, wgts):
+        """
+        setWeights changes the complex weight of one or several panels and updates the pat-
+        tern incrementally.
+
+        The array factor is linear in the weights and each panel contributes the separable
+        term Ey[:,p]*Ex[p,:], so changing the weights of K panels adds (new-old)*Ey[:,p]*
+        Ex[p,:] to the stored field: O(K*grid) instead of a rebuild over all panels.  The
+        first call after getPattern builds the field once (Ex, Ey, array factor and panel
+        factor); later calls reuse it. Rounding accumulates by ~1e-15 per update, call get-
+        Pattern to rebuild from scratch.
+
+        Parameters
+        ----------
+        panels = An integer or an array of integers giving the panel indexes (columns of
+          xy_panelPos, 0-13 for the default layout).
+        wgts = A scalar or an array (same size as PANELS) giving the new complex weights.
+          Use 0 to switch a panel off and 1 to restore it.
+
+        Examples
+        --------
+        >> ObjAnt = AmisrPattern(30, 70, maxphi=33)
+        >> ObjAnt.setWeights(5, 0)          # panel 5 offline
+        >> ObjAnt.setWeights([5, 12], [1, 0])
+        >> print ObjAnt.meanpos
+        """
+
+        if self.__field is None:
+            ex = self.__phasor(self.kk*numpy.outer(self.xpos, self.dcosx - self.Cx0))
+            ey = self.__phasor(self.kk*numpy.outer(self.dcosy - self.Cy0, self.ypos))
+            self.wgts = numpy.array(self.wgts, dtype=self.cdtype)
+            self.__field = {"ex":ex, "ey":ey, "farr":numpy.dot(ey*self.wgts, ex),
+                            "panel":self.__modPattern()}
+
+        panels = numpy.atleast_1d(panels)
+        wgts = numpy.broadcast_to(numpy.asarray(wgts, dtype=self.cdtype), panels.shape)
+        # A panel listed twice takes its last weight, as in an array assignment.
+        panels, ilast = numpy.unique(panels[::-1], return_index=True)
+        wgts = wgts[::-1][ilast]
+        delta = wgts - self.wgts[panels]
+        self.wgts[panels] = wgts
+
+        field = self.__field
+        field["farr"] += numpy.dot(field["ey"][:,panels]*delta, field["ex"][panels,:])
+
+        self.__setPattern(numpy.abs(field["farr"]*field["panel"])**2)
+
+    def __tiledPattern(self, xpos, ypos, wgts):
+        """
+        __tiledPattern computes the pattern in blocks of rows so that the temporaries (array
+        factor, panel factor and dipole term of one block) stay within self.maxbytes. Each
+        block is written into self.out (or a new array) and normalized in place once the
+        maximum is known, so norpattern is that array and pattern is not kept (it is  nor-
+        pattern*maxpattern). The peak memory traced while computing, output excluded, is
+        stored in self.peakmemory (in bytes).
+        """
+
+        if self.out is None:
+            self.out = numpy.empty((self.ny, self.nx), dtype=self.rdtype)
+        elif self.out.shape != (self.ny, self.nx):
+            raise ValueError("out must have shape (%d, %d)" % (self.ny, self.nx))
+        out = self.out
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+
+        ypos = numpy.asarray(ypos, dtype=float)
+        wgts = numpy.asarray(wgts).astype(self.cdtype)
+        ex = self.__phasor(self.kk*numpy.outer(xpos, self.dcosx - self.Cx0))
+        eex = self.__phasor(self.kk*numpy.outer(amisr_xypos[:,0], self.dcosx - self.Cx0))
+
+        # About 8 complex rows of temporaries per output row.
+        rowbytes = 8*self.nx*numpy.dtype(self.cdtype).itemsize
+        fixed = ex.nbytes + eex.nbytes
+        nrows = int(max(1, min(self.ny, (self.maxbytes - fixed)//rowbytes)))
+
+        cx = self.dcosx.astype(self.rdtype)[None,:]
+        maxpattern = -numpy.inf
+        for iy in range(0, self.ny, nrows):
+            v = self.dcosy[iy:iy+nrows]
+            farr = numpy.dot(self.__phasor(self.kk*numpy.outer(v - self.Cy0, ypos))*wgts, ex)
+            farr *= numpy.dot(self.__phasor(self.kk*numpy.outer(v - self.Cy0, amisr_xypos[:,1])), eex)
+            farr *= self.__dipPattern(cx, v.astype(self.rdtype)[:,None])
+            block = numpy.abs(farr)**2
+            del farr
+            if not self.just_rx:
+                block *= block
+            out[iy:iy+nrows] = block
+            maxpattern = numpy.nanmax([maxpattern, numpy.nanmax(block)])
+            del block
+
+        for iy in range(0, self.ny, nrows):
+            out[iy:iy+nrows] /= maxpattern
+
+        self.peakmemory = tracemalloc.get_traced_memory()[1] - base
+        if not tracing:
+            tracemalloc.stop()
+
+        if isinstance(out, numpy.memmap):
+            out.flush()
 
+        self.pattern = None
+        self.maxpattern = maxpattern
+        self.norpattern = out
+        if self.getcut==0:
+            self.__getBeamPars()
+
+    def getZoom(self, threshold=0.1, factor=4, margin=2, maxlobes=8, coarse=None):
+        """
+        getZoom refines the pattern around its lobes. The full-field pattern of this object
+        is kept as the coarse level; the main lobe and every lobe above THRESHOLD are recom-
+        puted exactly (see getGain) on a grid FACTOR times finer over the lobe's bounding
+        box plus MARGIN coarse samples. The main-beam parameters (meanpos, beamwidth)  are
+        then re-estimated on the fine main-lobe patch. If the refined peak exceeds the coarse
+        one, maxpattern and norpattern are renormalized to it.
+
+        Parameters
+        ----------
+        threshold = A scalar giving the normalized level above which a lobe is refined. The
+          default value is 0.1 (-10 dB).
+        factor = An integer giving the refinement of the patches. The default value is 4.
+        margin = An integer giving the number of coarse samples added around each lobe.
+        maxlobes = An integer giving the maximum number of patches (highest lobes first).
+        coarse = A CachedPattern of this beam (e.g. from a BeamAtlas) to use as the coarse
+          level instead of the pattern of this object, which then only provides the poin-
+          ting and can be built on a small grid. The default value is None.
+
+        Return
+        ------
+        patches = A list of (norpattern, dcosx, dcosy) tuples, main lobe first, with the lay-
+          out and normalization of NORPATTERN. It is also stored in self.patches. It is em-
+          pty, and the pattern is left unchanged, if no lobe reaches THRESHOLD.
+
+        Examples
+        --------
+        >> ObjAnt = AmisrPattern(30, 70, maxphi=33)
+        >> patches = ObjAnt.getZoom(threshold=0.1, factor=5)
+        >> print ObjAnt.beamwidth
+        """
+
+        if coarse is not None:
+            self.__setCoarse(coarse)
+
+        amp = numpy.nan_to_num(self.norpattern)
+        labels, nlobes = scipy.ndimage.label(amp >= threshold)
+        boxes = scipy.ndimage.find_objects(labels)
+        peaks = scipy.ndimage.maximum(amp, labels, numpy.arange(1, nlobes + 1))
+        order = numpy.argsort(peaks)[::-1][:maxlobes]
+
+        patches = []
+        for ilobe in order:
+            ys, xs = boxes[ilobe]
+            x0 = max(xs.start - margin, 0); x1 = min(xs.stop - 1 + margin, self.nx - 1)
+            y0 = max(ys.start - margin, 0); y1 = min(ys.stop - 1 + margin, self.ny - 1)
+            px = numpy.linspace(self.dcosx[x0], self.dcosx[x1], (x1 - x0)*factor + 1)
+            py = numpy.linspace(self.dcosy[y0], self.dcosy[y1], (y1 - y0)*factor + 1)
+            gain = self.getGain(px[None,:], py[:,None]).astype(self.rdtype)
+            patches.append((gain, px, py))
+
+        self.patches = patches
+        if len(patches) == 0:
+            return patches
+
+        peak = numpy.nanmax(patches[0][0])
+        if peak > 1:
+            self.maxpattern = self.maxpattern*peak
+            self.norpattern = self.norpattern/peak
+            patches = [(gain/peak, px, py) for gain, px, py in patches]
+
+        if self.getcut==0:
+            self.__getBeamPars(*patches[0])
+
+        self.patches = patches
+        return patches
+
+    def __setCoarse(self, coarse):
+        """
+        __setCoarse replaces the grid and the pattern of this object by those of a Cached-
+        Pattern of the same beam.
+        """
+
+        self.dcosx = numpy.asarray(coarse.dcosx, dtype=float)
+        self.dcosy = numpy.asarray(coarse.dcosy, dtype=float)
+        self.nx = self.dcosx.size
+        self.ny = self.dcosy.size
+        self.Cx = numpy.broadcast_to(self.dcosx.astype(self.rdtype)[None,:], (self.ny, self.nx))
+        self.Cy = numpy.broadcast_to(self.dcosy.astype(self.rdtype)[:,None], (self.ny, self.nx))
+        self.getcut = coarse.getcut
+        self.maxpattern = coarse.maxpattern
+        self.norpattern = numpy.asarray(coarse.norpattern, dtype=self.rdtype)
+        self.pattern = self.norpattern*self.maxpattern
+        self.meanpos = coarse.meanpos
+        self.beamwidth = getattr(coarse, 'beamwidth', None)
+        self.isolines = None
+
+    def getIsolines(self, levels=isoline_levels):
+        """
+        getIsolines extracts (once) the isolines of norpattern, including the refined patches
+        of getZoom, and keeps them in self.isolines. See patternIsolines.
+        """
+
+        self.isolines = patternIsolines(self.norpattern, self.dcosx, self.dcosy, levels=levels,
+                                        patches=self.patches)
+        return self.isolines
+
+    def __setPattern(self, pattern):
+        """
+        __setPattern stores a one-way pattern: squares it for the two-way case, normalizes
+        it and computes the main-beam parameters.
+        """
+
+        self.pattern = pattern
         if not self.just_rx:
             self.pattern *=self.pattern
 
@@ -1521,9 +1953,239 @@ class AmisrPattern():
         if self.getcut==0:
             self.__getBeamPars()
 
-    def __getBeamPars(self):
+    def getGain(self, dcosx, dcosy, normalize=True):
+        """
+        getGain returns the antenna pattern at an arbitrary list of directions,  using  the
+        pointing, panel positions and weights of the last getPattern. The cost scales with
+        the number of directions: no grid is built and nothing is interpolated.
+
+        Parameters
+        ----------
+        dcosx = An array giving the directional cosines for the x-axis of each direction.
+        dcosy = An array giving the directional cosines for the y-axis of each direction.
+        normalize = Set to True (default value) to divide by maxpattern, i.e. to return va-
+          lues comparable to norpattern.
+
+        Return
+        ------
+        gain = An array, with the shape of DCOSX, giving the pattern at each direction. Di-
+          rections outside the visible region (dcosx**2 + dcosy**2 >= 1) are NaN.
+
+        Examples
+        --------
+        >> ObjAnt = AmisrPattern(30, 70, maxphi=33)
+        >> gain = ObjAnt.getGain(dcosx_sun, dcosy_sun)
+        """
+
+        dcosx = numpy.asarray(dcosx, dtype=float)
+        dcosy = numpy.asarray(dcosy, dtype=float)
+        shape = numpy.broadcast(dcosx, dcosy).shape
+        u = numpy.broadcast_to(dcosx, shape).ravel()
+        v = numpy.broadcast_to(dcosy, shape).ravel()
+
+        du = (u - self.Cx0)[:,None]
+        dv = (v - self.Cy0)[:,None]
+        farr = numpy.dot(numpy.exp(1j*self.kk*(du*self.xpos + dv*self.ypos)), self.wgts)
+        farr *= numpy.exp(1j*self.kk*(du*amisr_xypos[:,0] + dv*amisr_xypos[:,1])).sum(axis=1)
+        farr *= self.__dipPattern(u, v)
+
+        gain = numpy.abs(farr)**2
+        if not self.just_rx:
+            gain *= gain
+        if normalize:
+            gain /= self.maxpattern
+
+        return gain.reshape(shape)
+
+    def getPatterns(self, azimuth, elevation, xy_panelPos=[], wgts=[], normalize=True, chunk=16):
+        """
+        getPatterns returns the antenna patterns of several pointings on the grid of this ob-
+        ject in one batched pass.
+
+        Steering only adds a phase EXP(-j*k*(xpos*Cx0 + ypos*Cy0)) per radiator, so the un-
+        steered x/y phase vectors and the dipole/ground term are computed once and shared by
+        every beam. Each chunk of beams is then a batched matrix product.
+
+        Parameters
+        ----------
+        azimuth = An array giving the azimuth (in degrees) of each beam.
+        elevation = An array giving the elevation (in degrees) of each beam.
+        xy_panelPos = A 2xN array giving the position of panels. Default is AMISR-14.
+        wgts = An array giving the weight of each panel. Default is ones.
+        normalize = Set to False to return the patterns without normalizing each beam to its
+          maximum. The default value is True.
+        chunk = An integer giving the number of beams evaluated together. The default value
+          is 16.
+
+        Return
+        ------
+        patterns = An array (nbeams,ny,nx) giving the (normalized) pattern of each beam.
+
+        Examples
+        --------
+        >> ObjAnt = AmisrPattern(maxphi=33)
+        >> patterns = ObjAnt.getPatterns([0,30,-45],[90,70,60])
+        """
+
+        azimuth = numpy.atleast_1d(numpy.asarray(azimuth, dtype=float))
+        elevation = numpy.atleast_1d(numpy.asarray(elevation, dtype=float))
+        cx0 = numpy.cos(numpy.radians(elevation))*numpy.sin(numpy.radians(azimuth))
+        cy0 = numpy.cos(numpy.radians(elevation))*numpy.cos(numpy.radians(azimuth))
+
+        if len(xy_panelPos)>0:
+            xpos = numpy.asarray(xy_panelPos[0], dtype=float)
+            ypos = numpy.asarray(xy_panelPos[1], dtype=float)
+        else:
+            xpos = amisr_panelpos[0]
+            ypos = amisr_panelpos[1]
+
+        if len(wgts)<1:
+            wgts = numpy.ones(len(xpos))
+        wgts = numpy.asarray(wgts)
+
+        # Unsteered phase vectors, shared by all beams.
+        pex = self.__phasor(self.kk*numpy.outer(xpos, self.dcosx))
+        pey = self.__phasor(self.kk*numpy.outer(self.dcosy, ypos))*wgts.astype(self.cdtype)
+        eex = self.__phasor(self.kk*numpy.outer(amisr_xypos[:,0], self.dcosx))
+        eey = self.__phasor(self.kk*numpy.outer(self.dcosy, amisr_xypos[:,1]))
+        dippow = numpy.abs(self.__dipPattern())**2
+
+        patterns = numpy.empty((cx0.size, self.ny, self.nx), dtype=self.rdtype)
+        for ib in range(0, cx0.size, chunk):
+            bx = cx0[ib:ib+chunk, None]
+            by = cy0[ib:ib+chunk, None]
+            psteer = self.__phasor(-self.kk*(bx*xpos + by*ypos))
+            esteer = self.__phasor(-self.kk*(bx*amisr_xypos[:,0] + by*amisr_xypos[:,1]))
+
+            farr = numpy.matmul(pey[None,:,:]*psteer[:,None,:], pex)
+            farr *= numpy.matmul(eey[None,:,:]*esteer[:,None,:], eex)
+
+            block = numpy.abs(farr)**2
+            block *= dippow
+            if not self.just_rx:
+                block *= block
+            patterns[ib:ib+chunk] = block
+
+        if normalize:
+            patterns /= numpy.nanmax(patterns, axis=(1,2))[:,None,None]
+
+        return patterns
+
+    def getSweep(self, freqs, xy_panelPos=[], wgts=[], truedelay=False, chunk=16, patterns=False):
         """
-        _getBeamPars computes the main-beam parameters of the antenna.
+        getSweep evaluates the pattern of this beam over several frequencies in one batched
+        pass and returns the main-beam position and width at each of them.
+
+        The array is phase-steered at the design frequency fc, so the steering phase -k0*(x-
+        pos*Cx0 + ypos*Cy0) is fixed while the propagation phase k*(xpos*Cx + ypos*Cy) scales
+        with frequency: the beam squints to (Cx0,Cy0)*fc/f. The path differences and the
+        dipole/ground term are computed once and shared by every frequency; each chunk of
+        frequencies is a batched matrix product.
+
+        Parameters
+        ----------
+        freqs = An array giving the frequencies (in MHz).
+        xy_panelPos = A 2xN array giving the position of panels. Default is AMISR-14.
+        wgts = An array giving the weight of each panel. Default is ones.
+        truedelay = Set to True to model true-time-delay steering (no squint). The default
+          is phase steering at fc.
+        chunk = An integer giving the number of frequencies evaluated together.
+        patterns = Set to True to also return the normalized patterns.
+
+        Return
+        ------
+        sweep = A dictionary with
+          freqs = The frequencies (F).
+          meanpos = An array (F,2) giving the fitted beam position (directional cosines).
+          beamwidth = An array (F,2) giving the half-power beamwidth (degrees) in x and y.
+          drift = An array (F,2) giving meanpos minus the meanpos of this object (at fc).
+          patterns = An array (F,ny,nx), only if PATTERNS is True.
+
+        Examples
+        --------
+        >> ObjAnt = AmisrPattern(30, 70, maxphi=33, fc=445)
+        >> sweep = ObjAnt.getSweep(numpy.linspace(440, 450, 41))
+        >> plt.plot(sweep['freqs'], sweep['drift'][:,0])
+        """
+
+        freqs = numpy.atleast_1d(numpy.asarray(freqs, dtype=float))
+
+        if len(xy_panelPos)>0:
+            xpos = numpy.asarray(xy_panelPos[0], dtype=float)
+            ypos = numpy.asarray(xy_panelPos[1], dtype=float)
+        else:
+            xpos = amisr_panelpos[0]
+            ypos = amisr_panelpos[1]
+
+        if len(wgts)<1:
+            wgts = numpy.ones(len(xpos))
+        wgts = numpy.asarray(wgts).astype(self.cdtype)
+
+        # Path differences (in meters), shared by every frequency.
+        pdx = numpy.outer(xpos, self.dcosx)
+        pdy = numpy.outer(self.dcosy, ypos)
+        edx = numpy.outer(amisr_xypos[:,0], self.dcosx)
+        edy = numpy.outer(self.dcosy, amisr_xypos[:,1])
+        psteer = xpos*self.Cx0 + ypos*self.Cy0
+        esteer = amisr_xypos[:,0]*self.Cx0 + amisr_xypos[:,1]*self.Cy0
+        dippow = numpy.abs(self.__dipPattern())**2
+
+        kf = 2.*numpy.pi*freqs/300.
+        ks = kf if truedelay else numpy.full(freqs.size, self.kk)
+
+        amp = numpy.empty((freqs.size, self.ny, self.nx), dtype=self.rdtype)
+        for jf in range(0, freqs.size, chunk):
+            kk = kf[jf:jf+chunk, None, None]
+            ss = ks[jf:jf+chunk, None, None]
+            pex = self.__phasor(kk*pdx)
+            pey = self.__phasor(kk*pdy - ss*psteer)*wgts
+            eex = self.__phasor(kk*edx)
+            eey = self.__phasor(kk*edy - ss*esteer)
+
+            farr = numpy.matmul(pey, pex)
+            farr *= numpy.matmul(eey, eex)
+
+            block = numpy.abs(farr)**2
+            block *= dippow
+            if not self.just_rx:
+                block *= block
+            amp[jf:jf+chunk] = block
+
+        amp /= numpy.nanmax(amp, axis=(1,2))[:,None,None]
+
+        meanpos = numpy.zeros((freqs.size, 2))
+        beamwidth = numpy.zeros((freqs.size, 2))
+        saved = (self.meanpos, self.beamwidth)
+        for jf in range(freqs.size):
+            meanpos[jf], beamwidth[jf] = self.__getBeamPars(amp[jf], self.dcosx, self.dcosy)
+        self.meanpos, self.beamwidth = saved
+
+        sweep = {"freqs":freqs, "meanpos":meanpos, "beamwidth":beamwidth,
+                 "drift":meanpos - numpy.asarray(self.meanpos)}
+        if patterns:
+            sweep["patterns"] = amp
+        return sweep
+
+    def __getBeamPars(self, amp=None, dcosx=None, dcosy=None):
+        """
+        _getBeamPars computes the main-beam parameters of the antenna (meanpos and the half-
+        power beamwidth, in degrees, along x and y).
+
+        A gaussian is fitted to the main beam. By default gaussfit.quadfit is used: a closed-
+        form log-quadratic estimate refined by a few analytic Gauss-Newton steps. For a sin-
+        gle, gaussian-shaped lobe above half power, sampled by at least 3 points per axis, it
+        agrees with the least-squares fit (exact=True, gaussfit.fitgaussian) within 1e-5 in
+        meanpos and 1e-4 (relative) in width. The two fits differ for split or non-gaussian
+        main beams, where exact=True should be used.
+
+        Parameters
+        ----------
+        amp = A (ny,nx) array giving the normalized pattern to fit. Default is norpattern.
+        dcosx, dcosy = Arrays giving the axes of AMP. Default is the pattern grid.
+
+        Return
+        ------
+        meanpos, beamwidth = The values also stored in self.meanpos and self.beamwidth.
 
         Modification history
         --------------------
@@ -1531,32 +2193,41 @@ class AmisrPattern():
         Converted to Python by Freddy R. Galindo, ROJ, 20 September 2009.
         """
 
-        dx = self.dcosx[1] - self.dcosx[0]
-        dy = self.dcosy[1] - self.dcosy[0]
+        if amp is None:
+            amp = self.norpattern
+            dcosx = self.dcosx
+            dcosy = self.dcosy
 
-        amp = self.norpattern
+        dx = dcosx[1] - dcosx[0]
+        dy = dcosy[1] - dcosy[0]
 
-        xx =  numpy.resize(self.dcosx,(self.nx,self.nx)).transpose()
-        yy =  numpy.resize(self.dcosy,(self.ny,self.ny))
+        amp = amp.transpose()   # (nx,ny), as in JroPattern
 
-        mm0 = amp[numpy.where(amp > 0.5)]
-        xx0 = xx[numpy.where(amp > 0.5)]
-        yy0 = yy[numpy.where(amp > 0.5)]
+        xx =  numpy.broadcast_to(dcosx[:,None],amp.shape)
+        yy =  numpy.broadcast_to(dcosy[None,:],amp.shape)
+
+        main = numpy.where(amp > 0.5)
+        mm0 = amp[main]
+        xx0 = xx[main]
+        yy0 = yy[main]
 
         xc = numpy.sum(mm0*xx0)/numpy.sum(mm0)
         yc = numpy.sum(mm0*yy0)/numpy.sum(mm0)
         rc = numpy.sqrt(mm0.size*dx*dy/numpy.pi)
 
-        nnx = numpy.where(numpy.abs(self.dcosx - xc) < rc)
-        nny = numpy.where(numpy.abs(self.dcosy - yc) < rc)
+        nnx = numpy.where(numpy.abs(dcosx - xc) < rc)
+        nny = numpy.where(numpy.abs(dcosy - yc) < rc)
 
         mm1 = amp[numpy.min(nnx):numpy.max(nnx)+1,numpy.min(nny):numpy.max(nny)+1]
-        xx1 = self.dcosx[numpy.min(nnx):numpy.max(nnx)+1]
-        yy1 = self.dcosy[numpy.min(nny):numpy.max(nny)+1]
+        xx1 = dcosx[numpy.min(nnx):numpy.max(nnx)+1]
+        yy1 = dcosy[numpy.min(nny):numpy.max(nny)+1]
 
         # fitting data into the main beam.
         
-        params = gaussfit.fitgaussian(mm1)
+        if self.exact:
+            params = gaussfit.fitgaussian(mm1)
+        else:
+            params = gaussfit.quadfit(mm1)
 
         # Tranforming from indexes to axis' values
         xcenter = xx1[0] + (((xx1[xx1.size-1] - xx1[0])/(xx1.size -1))*(params[1]))
@@ -1571,13 +2242,20 @@ class AmisrPattern():
         #print  'BWHP:     %f' %(2*numpy.sqrt(2*meanwx)*numpy.sqrt(-numpy.log(0.5)))
 
         self.meanpos = meanpos
+        self.beamwidth = 2*numpy.sqrt(-2*numpy.log(0.5))*numpy.array([xwidth,ywidth])
 
+        return self.meanpos, self.beamwidth
 
-    def __dipPattern(self):
+
+    def __dipPattern(self, Cx=None, Cy=None):
         """
         _dipPattern function computes the dipole's pattern to  the AMISR radar. The next
         equation defines the pattern as a function of the mainlobe direction:
 
+        Parameters
+        ----------
+        Cx, Cy = Arrays giving the directional cosines to evaluate. Default is the pattern
+          grid (self.Cx, self.Cy).
 
         Return dipole pattern
         ------
@@ -1589,13 +2267,17 @@ class AmisrPattern():
         Writen by Joab Apaza, ROJ, July 2023.
         """
 
-        Cz2 = 1-(self.Cx**2+self.Cy**2)
+        if Cx is None:
+            Cx = self.Cx
+            Cy = self.Cy
+
+        Cz2 = 1-(Cx**2+Cy**2)
         Cz2[Cz2<=0] = numpy.nan
         Cz = numpy.sqrt(Cz2)
-        Cy2 = 1 - self.Cy**2
+        Cy2 = 1 - Cy**2
         Cy2[Cy2<=0] = numpy.nan
         sinth = numpy.sqrt(Cy2)
-        DIP = numpy.cos(numpy.pi/2*self.Cy)/sinth
+        DIP = numpy.cos(numpy.pi/2*Cy)/sinth
         Gnd= 2j*numpy.sin(numpy.pi/2*Cz)
 
         return DIP*Gnd
@@ -1615,51 +2297,230 @@ class AmisrPattern():
         --------------------
         Writen by Joab Apaza, ROJ, July 2023.
         """
-        _xypos = numpy.asarray([[ 0.        ,  0.        ],
-            [-0.15802247,  0.43434   ],
-            [ 0.        ,  0.86868   ],
-            [-0.15802247,  1.30302   ],
-            [ 0.        ,  1.73736   ],
-            [-0.15802247,  2.1717    ],
-            [ 0.        ,  2.60604   ],
-            [-0.15802247,  3.04038   ],
-            [ 0.495808  ,  0.        ],
-            [ 0.33778553,  0.43434   ],
-            [ 0.495808  ,  0.86868   ],
-            [ 0.33778553,  1.30302   ],
-            [ 0.495808  ,  1.73736   ],
-            [ 0.33778553,  2.1717    ],
-            [ 0.495808  ,  2.60604   ],
-            [ 0.33778553,  3.04038   ],
-            [ 0.991616  ,  0.        ],
-            [ 0.83359353,  0.43434   ],
-            [ 0.991616  ,  0.86868   ],
-            [ 0.83359353,  1.30302   ],
-            [ 0.991616  ,  1.73736   ],
-            [ 0.83359353,  2.1717    ],
-            [ 0.991616  ,  2.60604   ],
-            [ 0.83359353,  3.04038   ],
-            [ 1.487424  ,  0.        ],
-            [ 1.32940153,  0.43434   ],
-            [ 1.487424  ,  0.86868   ],
-            [ 1.32940153,  1.30302   ],
-            [ 1.487424  ,  1.73736   ],
-            [ 1.32940153,  2.1717    ],
-            [ 1.487424  ,  2.60604   ],
-            [ 1.32940153,  3.04038   ]])
-        
-         
-        FPanel = 0
-        for i in range(32):
-            xa = _xypos[i, 0]/self.eomwl
-            ya = _xypos[i, 1]/self.eomwl
-            FPanel += numpy.exp(1j*2*numpy.pi*xa*(self.Cx-self.Cx0) + 1j*2*numpy.pi*ya*(self.Cy-self.Cy0))
+
+        FPanel = self.__arrayFactor(amisr_xypos[:,0], amisr_xypos[:,1])
         
         dipole = self.__dipPattern()
         
         return FPanel*dipole
 
-    
+    def __isUniform(self, dcos=None):
+        """
+        __isUniform returns True when dcosx and dcosy (or DCOS, if given) are uniformly spa-
+        ced, i.e. when the pattern grid can be served by shifting a precomputed array factor
+        or evaluated with chirp-z transforms.
+        """
+
+        if dcos is not None:
+            step = numpy.diff(dcos)
+            return (step.size==0) or numpy.allclose(step, step[0])
+
+        if (self.nx<2) or (self.ny<2):
+            return False
+        dx = numpy.diff(self.dcosx)
+        dy = numpy.diff(self.dcosy)
+        return numpy.allclose(dx, dx[0]) and numpy.allclose(dy, dy[0])
+
+    def __shiftedPattern(self, xpos, ypos, wgts):
+        """
+        __shiftedPattern returns the antenna pattern steering a precomputed  array factor.
+
+        Panel and element factors  depend only on (Cx-Cx0, Cy-Cy0),  so |FPanel*farr|**2 is
+        computed once, unsteered (Cx0=Cy0=0), on an extended grid whose step is the output
+        step divided by OVERSAMPLE and whose margins cover every pointing up to  maxsteer.
+        Steering to (Cx0, Cy0) is then a strided slice of that table plus a bilinear sub-
+        grid interpolation when the shift is not a multiple of the table step.  The dipole
+        and ground term, which depends on the absolute (Cx, Cy), is cached per grid and ap-
+        plied afterwards. Tables live in AmisrPattern.steerCache, shared by every object.
+
+        With the default 101x101 grid and OVERSAMPLE=2 the normalized pattern differs from
+        the direct evaluation by less than 1e-2 (about 1e-3 with OVERSAMPLE=4);  shifts
+        that fall on the table grid are exact. Pointings beyond maxsteer are evaluated di-
+        rectly.
+
+        Return
+        ------
+        pattern = An array giving the modelled (one-way) antenna pattern.
+        """
+
+        if (abs(self.Cx0)>self.maxsteer) or (abs(self.Cy0)>self.maxsteer):
+            farr = self.__arrayFactor(xpos, ypos, wgts)
+            return numpy.abs(farr*self.__modPattern())**2
+
+        os_ = self.oversample
+        dx = (self.dcosx[-1] - self.dcosx[0])/(self.nx - 1)
+        dy = (self.dcosy[-1] - self.dcosy[0])/(self.ny - 1)
+        sx = dx/os_
+        sy = dy/os_
+        mx = int(numpy.ceil(self.maxsteer/sx))
+        my = int(numpy.ceil(self.maxsteer/sy))
+
+        key = (self.nx, self.ny, self.dcosx[0], self.dcosy[0], dx, dy, os_, self.eomwl, self.precision,
+               numpy.asarray(xpos, dtype=float).tobytes(), numpy.asarray(ypos, dtype=float).tobytes(),
+               numpy.asarray(wgts).tobytes())
+
+        tables = AmisrPattern.steerCache.pop(key, None)
+        if tables is None:
+            ux = self.dcosx[0] - mx*sx + numpy.arange((self.nx - 1)*os_ + 2*mx + 2)*sx
+            uy = self.dcosy[0] - my*sy + numpy.arange((self.ny - 1)*os_ + 2*my + 2)*sy
+            farr = self.__arrayFactor(xpos, ypos, wgts, u=ux, v=uy)
+            farr *= self.__arrayFactor(amisr_xypos[:,0], amisr_xypos[:,1], u=ux, v=uy)
+            tables = {"afpow":numpy.abs(farr)**2, "dippow":numpy.abs(self.__dipPattern())**2}
+            while len(AmisrPattern.steerCache)>=self.steerCacheSize:
+                AmisrPattern.steerCache.pop(next(iter(AmisrPattern.steerCache)))
+        AmisrPattern.steerCache[key] = tables
+
+        # Table index of the first output sample and fractional remainder.
+        tx = mx - self.Cx0/sx
+        ty = my - self.Cy0/sy
+        kx = int(numpy.floor(tx)); fx = float(tx - kx)
+        ky = int(numpy.floor(ty)); fy = float(ty - ky)
+
+        afpow = tables["afpow"]
+        xs = slice(kx, kx + (self.nx - 1)*os_ + 1, os_)
+        xs1 = slice(kx + 1, kx + 1 + (self.nx - 1)*os_ + 1, os_)
+        ys = slice(ky, ky + (self.ny - 1)*os_ + 1, os_)
+        ys1 = slice(ky + 1, ky + 1 + (self.ny - 1)*os_ + 1, os_)
+
+        pattern = (1 - fy)*((1 - fx)*afpow[ys,xs] + fx*afpow[ys,xs1]) + \
+                  fy*((1 - fx)*afpow[ys1,xs] + fx*afpow[ys1,xs1])
+
+        return pattern*tables["dippow"]
+
+    def __arrayFactor(self, xpos, ypos, wgts=None, u=None, v=None):
+        """
+        __arrayFactor computes the steered array factor of a set of radiators placed at
+        (xpos, ypos):
+
+        F(Cx,Cy) = TOTAL(wgts*EXP(j*k*(xpos*(Cx-Cx0) + ypos*(Cy-Cy0))))
+
+        The phase is separable in x and y, so the sum over N radiators is evaluated as a
+        single matrix product Ey(ny,N) x Ex(N,nx) instead of N full-grid exponentials.
+
+        Parameters
+        ----------
+        xpos = An array giving the x position (in meters) of each radiator.
+        ypos = An array giving the y position (in meters) of each radiator.
+        wgts = An array giving the complex weight of each radiator. Default is ones.
+        u = An array giving the x offsets (Cx-Cx0) to evaluate. Default is dcosx-Cx0.
+        v = An array giving the y offsets (Cy-Cy0) to evaluate. Default is dcosy-Cy0.
+
+        Return
+        ------
+        farr = A complex (v.size,u.size) array giving the array factor on the u/v grid.
+        """
+
+        xpos = numpy.asarray(xpos, dtype=float)
+        ypos = numpy.asarray(ypos, dtype=float)
+        if u is None:
+            u = self.dcosx - self.Cx0
+        if v is None:
+            v = self.dcosy - self.Cy0
+
+        if self.fftopt>0 and self.__isUniform(u) and self.__isUniform(v):
+            farr = self.__cztArrayFactor(xpos, ypos, wgts, u, v)
+            if farr is not None:
+                return farr
+
+        ex = self.__phasor(self.kk*numpy.outer(xpos, u))
+        ey = self.__phasor(self.kk*numpy.outer(v, ypos))
+        if wgts is not None:
+            ey = ey*numpy.asarray(wgts).astype(self.cdtype)
+
+        return numpy.dot(ey, ex)
+
+    def __cztArrayFactor(self, xpos, ypos, wgts, u, v):
+        """
+        __cztArrayFactor computes the array factor of __arrayFactor on a uniform u/v grid
+        with chirp-z transforms.
+
+        Positions are written as  pos = offset + step*m, with m integer (see __lattice). The
+        radiators sharing an (x,y) offset form a sub-lattice whose weights are gridded into
+        an array A[n,m]; on the grid u = u0 + i*du the sum over m is then
+
+        TOTAL(A[n,m]*EXP(j*k*step*m*u)) = CZT(A, a=EXP(-j*k*step*u0), w=EXP(j*k*step*du))
+
+        (likewise along y), and the offset enters as the phase EXP(j*k*offset*u). Positions
+        off the lattice (e.g. the staggered rows of AMISR elements) only add sub-lattices,
+        so the result equals the direct sum to rounding (~1e-12 relative), at a cost of
+        O(points*log(points)) per sub-lattice instead of O(radiators*points).
+
+        Return
+        ------
+        farr = A complex (v.size,u.size) array giving the array factor on the u/v grid,  or
+          None when the positions have no lattice structure (the gridded weights would be
+          much larger than the number of radiators); the direct sum is used then.
+        """
+
+        if wgts is None:
+            wgts = numpy.ones(xpos.size)
+        wgts = numpy.asarray(wgts, dtype=complex)
+
+        stepx, mx, offx = self.__lattice(xpos)
+        stepy, my, offy = self.__lattice(ypos)
+        du = u[1] - u[0] if u.size>1 else 0.
+        dv = v[1] - v[0] if v.size>1 else 0.
+
+        cztx = scipy.signal.CZT(mx.max() + 1, u.size, w=numpy.exp(1j*self.kk*stepx*du),
+                                a=numpy.exp(-1j*self.kk*stepx*u[0]))
+        czty = scipy.signal.CZT(my.max() + 1, v.size, w=numpy.exp(1j*self.kk*stepy*dv),
+                                a=numpy.exp(-1j*self.kk*stepy*v[0]))
+
+        labels = numpy.round(numpy.array([offx/stepx, offy/stepy]).T*1e6)
+        labels, group = numpy.unique(labels, axis=0, return_inverse=True)
+        group = group.ravel()
+        if labels.shape[0]*(mx.max() + 1)*(my.max() + 1) > 16*xpos.size:
+            return None
+
+        farr = numpy.zeros((v.size, u.size), dtype=self.cdtype)
+        for ig in range(labels.shape[0]):
+            sel = group==ig
+            coef = numpy.zeros((my.max() + 1, mx.max() + 1), dtype=complex)
+            numpy.add.at(coef, (my[sel], mx[sel]), wgts[sel])
+            sub = czty(cztx(coef, axis=1), axis=0)
+            sub *= numpy.exp(1j*self.kk*numpy.mean(offy[sel])*v)[:,None]
+            sub *= numpy.exp(1j*self.kk*numpy.mean(offx[sel])*u)[None,:]
+            farr += sub.astype(self.cdtype, copy=False)
+
+        return farr
+
+    @staticmethod
+    def __lattice(pos, tol=1e-6):
+        """
+        __lattice writes positions as pos = offset + step*m with m >= 0 integer. The step is
+        the spacing, among differences between nearby positions, that links the most pairs
+        of positions (averaged over those pairs, so that it is not rounded).
+
+        Return
+        ------
+        step, m, offset = The lattice step, and the integer index and offset of each position.
+        """
+
+        upos = numpy.unique(numpy.round(pos/tol)*tol)
+        if upos.size==1:
+            return 1., numpy.zeros(pos.size, dtype=int), pos.copy()
+
+        candidates = numpy.concatenate([upos[k:] - upos[:-k] for k in range(1, min(4, upos.size))])
+        candidates = numpy.unique(numpy.round(candidates/tol)*tol)
+        candidates = candidates[candidates>tol]
+        score = [numpy.isclose(upos[:,None] + step, upos[None,:], atol=tol).sum() for step in candidates]
+        step = candidates[numpy.argmax(score)]
+        pairs = (upos[None,:] - upos[:,None])
+        step = numpy.mean(pairs[numpy.abs(pairs - step) < tol])
+
+        origin = upos[0]
+        m = numpy.floor((pos - origin)/step + tol).astype(int)
+        return step, m, pos - m*step
+
+    def __phasor(self, phase):
+        """
+        __phasor returns EXP(j*phase) in the complex dtype of the selected precision. Phases
+        are formed in double precision; only the (small) phasor tables are rounded.
+        """
+
+        return numpy.exp(1j*phase).astype(self.cdtype, copy=False)
+
+
 
 
 class overJroShow:
@@ -1667,7 +2528,7 @@ class overJroShow:
     __serverdocspath = ''
     __tmpDir = ''
 
-    def __init__(self, site=1, title='', heights=None, maxphi=None,ploteo=0):
+    def __init__(self, site=1, title='', heights=None, maxphi=None,ploteo=0,atlas=None,library=None):
         self.year = None
         self.month = None
         self.dom = None
@@ -1700,6 +2561,10 @@ class overJroShow:
         self.plotname2 = None
         self.scriptHeaders = 0
         self.ploteo=ploteo
+        # Optional Beam_Atlas.BeamAtlas serving precomputed AMISR patterns.
+        self.atlas = atlas
+        # Optional Jro_Library.JroLibrary serving precomputed JRO patterns.
+        self.library = library
         if site==1:
             self.glat = -11.95
             self.glon = -76.8667
@@ -1759,7 +2624,7 @@ class overJroShow:
         self.yg = numpy.dot(self.MT3.transpose(),numpy.array([0,1,0]))
         self.zg = numpy.dot(self.MT3.transpose(),numpy.array([0,0,1]))    
 
-    def plotPattern(self, site, azimuth, elevation, date, phases, gain_tx, gain_rx, ues, just_rx, angle, plot=True):
+    def plotPattern(self, site, azimuth, elevation, date, phases, gain_tx, gain_rx, ues, just_rx, angle, plot=True, pattern_id=None):
         fullDCOSX = []
         fullDCOSY = []
         # Plotting Antenna patterns.
@@ -1772,29 +2637,53 @@ class overJroShow:
         date = TimeTools.Time(date.year,date.month,date.day).change2strdate(mode=2)
         if site==1:
             mesg = 'Over Jicamarca: ' + date[0]
-            ObjAnt = JroPattern(pattern=0,
-                            filename=None,
-                            path=None,
-                            nptsx=self.nptsx,
-                            nptsy=self.nptsy,
-                            maxphi=angle,
-                            fftopt=self.fftopt,
-                            phases=phases,
-                            gain_tx=gain_tx,
-                            gain_rx=gain_rx,
-                            ues=ues,
-                            just_rx=just_rx
-                            )
+
+            ObjAnt = None
+            if self.library is not None and self.fftopt==0:
+                ObjAnt = self.library.pattern(phases,
+                                gain_tx,
+                                gain_rx,
+                                ues,
+                                just_rx,
+                                maxphi=angle,
+                                nptsx=self.nptsx,
+                                nptsy=self.nptsy,
+                                pattern_id=pattern_id
+                                )
+            if ObjAnt is None:
+                ObjAnt = JroPattern(pattern=0,
+                                filename=None,
+                                path=None,
+                                nptsx=self.nptsx,
+                                nptsy=self.nptsy,
+                                maxphi=angle,
+                                fftopt=self.fftopt,
+                                phases=phases,
+                                gain_tx=gain_tx,
+                                gain_rx=gain_rx,
+                                ues=ues,
+                                just_rx=just_rx
+                                )
         else:
             mesg = 'Over AMISR-14: ' + date[0]
             
-            ObjAnt = AmisrPattern(azimuth,
-                            elevation,
-                            maxphi=angle,
-                            nptsx=self.nptsx,
-                            nptsy=self.nptsy,
-                            just_rx=False
-                            )
+            ObjAnt = None
+            if self.atlas is not None:
+                ObjAnt = self.atlas.pattern(azimuth,
+                                elevation,
+                                maxphi=angle,
+                                nptsx=self.nptsx,
+                                nptsy=self.nptsy,
+                                just_rx=False
+                                )
+            if ObjAnt is None:
+                ObjAnt = AmisrPattern(azimuth,
+                                elevation,
+                                maxphi=angle,
+                                nptsx=self.nptsx,
+                                nptsy=self.nptsy,
+                                just_rx=False
+                                )
             cwd = os.getcwd()
             pointings = numpy.genfromtxt(cwd+'/utils/UMET_beamcodes.csv', delimiter=',')
             fullDCOSX = numpy.cos(numpy.radians(pointings[:,2]))*numpy.sin(numpy.radians(pointings[:,1]))
@@ -1812,7 +2701,8 @@ class overJroShow:
                             y=ObjAnt.dcosy,
                             getCut=ObjAnt.getcut,
                             title=self.ptitle,
-                            save=False)
+                            save=False,
+                            isolines=getattr(ObjAnt,'isolines',None))
 
             
             self.pattern_plot.plotRaDec(site=site, 
@@ -2187,7 +3077,22 @@ def skynoise_plot(year, month, day):
     
     return buf
 
-def overjro_plot(site, pattern_id, date, angle, height, bodys,  azimuth, elevation):
+def jroLibrary(filename=None):
+    """
+    jroLibrary returns the Jro_Library.JroLibrary of FILENAME (default ./utils/JRO_library.npy),
+    opened once and kept, or None if the file does not exist.
+    """
+
+    if filename is None:
+        filename = os.getcwd()+'/utils/JRO_library.npy'
+    if filename not in jro_libraries:
+        if not os.path.exists(filename):
+            return None
+        from Jro_Library import JroLibrary
+        jro_libraries[filename] = JroLibrary(filename)
+    return jro_libraries[filename]
+
+def overjro_plot(site, pattern_id, date, angle, height, bodys,  azimuth, elevation, atlas=None, library=None):
     
     if site!=1:
         pattern_id = 0
@@ -2195,7 +3100,10 @@ def overjro_plot(site, pattern_id, date, angle, height, bodys,  azimuth, elevati
     pattern = select_pattern(pattern = pattern_id)
 
     if site==1: #Jicamarca
-        ob = overJroShow(site, pattern['title'], heights=height)
+        # Predefined patterns are served from the JRO library when it has them.
+        if library is None or isinstance(library, str):
+            library = jroLibrary(library)
+        ob = overJroShow(site, pattern['title'], heights=height, library=library)
 
     else:   #AMISR-14
         if azimuth > 180 or azimuth < -180:
@@ -2206,7 +3114,7 @@ def overjro_plot(site, pattern_id, date, angle, height, bodys,  azimuth, elevati
             elevation = 49.93
         beam,azimuth,elevation = findRealBeam(azimuth,elevation)
         tamisr = 'AMISR-14 at {:2.2f}° Az - {:2.2f}° El'.format(azimuth, elevation)
-        ob = overJroShow(site, title=tamisr, heights=height, maxphi=10)
+        ob = overJroShow(site, title=tamisr, heights=height, maxphi=10, atlas=atlas)
 
     if site==2 and angle==5:
         angle=40
@@ -2221,7 +3129,8 @@ def overjro_plot(site, pattern_id, date, angle, height, bodys,  azimuth, elevati
         pattern['gainrx'], 
         pattern['ues'], 
         pattern['justrx'], 
-        angle
+        angle,
+        pattern_id=pattern_id
         )
     
     if 'bfield' in bodys:
@@ -2341,3 +3250,181 @@ def findRealBeam(azimuth, elevation,path=''):
     nbeam = beam1[sorted[0]]
 
     return validpointings[nbeam,0:3]
+
+
+def beamOverlap(beamcodes, path='', step=(0.01, 0.004), margin=(0.15, 0.05), just_rx=False,
+                precision='single'):
+    """
+    beamOverlap returns the normalized overlap of the power patterns of a set of AMISR-14
+    beamcodes:
+
+    O[i,j] = TOTAL(Pi*Pj*dOmega)/SQRT(TOTAL(Pi*Pi*dOmega)*TOTAL(Pj*Pj*dOmega))
+
+    All patterns are computed in one batched pass (AmisrPattern.getPatterns) on a shared
+    grid that covers every beam plus MARGIN, and the N x N inner products are a single ma-
+    trix product, so the cost grows with N*grid instead of N**2*grid.
+
+    Parameters
+    ----------
+    beamcodes = A list of beamcodes, as integers or strings ('0xF923' or decimal).
+    path = A string giving the beamcode table. Default is ./utils/UMET_beamcodes.csv.
+    step = A 2-elements tuple giving the grid step (directional cosines) in x and y. The
+      defaults sample the half-power width with ~15 (x) and ~6 (y) points.
+    margin = A 2-elements tuple giving the grid margin around the beams in x and y.
+    just_rx = Set to True to use the one-way pattern. The default is the two-way pattern.
+    precision = 'single' (default value) or 'double', see AmisrPattern.
+
+    Return
+    ------
+    overlap = A (N,N) array, 1 on the diagonal.
+
+    Examples
+    --------
+    >> overlap = beamOverlap(['0xF923', '0xF924', '0xF925'], path='UMET_beamcodes.csv')
+    """
+
+    if len(path) == 0:
+        path = os.getcwd()+'/utils/UMET_beamcodes.csv'
+    validpointings = numpy.genfromtxt(path, delimiter=',')
+
+    codes = []
+    for code in beamcodes:
+        if isinstance(code, str):
+            code = int(code, 16) if code.lower().startswith('0x') else int(code)
+        codes.append(int(code))
+    rows = [numpy.where(validpointings[:,0] == code)[0] for code in codes]
+    missing = [hex(code) for code, row in zip(codes, rows) if row.size == 0]
+    if len(missing) > 0:
+        raise ValueError("Beamcodes not found in %s: %s" % (path, ", ".join(missing)))
+    rows = numpy.array([row[0] for row in rows])
+
+    azimuth = validpointings[rows,1]
+    elevation = validpointings[rows,2]
+    cx0 = numpy.cos(numpy.radians(elevation))*numpy.sin(numpy.radians(azimuth))
+    cy0 = numpy.cos(numpy.radians(elevation))*numpy.cos(numpy.radians(azimuth))
+
+    x0 = max(cx0.min() - margin[0], -1.); x1 = min(cx0.max() + margin[0], 1.)
+    y0 = max(cy0.min() - margin[1], -1.); y1 = min(cy0.max() + margin[1], 1.)
+    dcosx = numpy.linspace(x0, x1, int(numpy.ceil((x1 - x0)/step[0])) + 1)
+    dcosy = numpy.linspace(y0, y1, int(numpy.ceil((y1 - y0)/step[1])) + 1)
+
+    ObjAnt = AmisrPattern(azimuth[0], elevation[0], dcosx=dcosx, dcosy=dcosy, just_rx=just_rx,
+                          precision=precision)
+    patterns = ObjAnt.getPatterns(azimuth, elevation)
+    patterns = numpy.nan_to_num(patterns).reshape(len(codes), -1)
+
+    # Solid angle of each grid cell, dOmega = du*dv/Cz.
+    cz2 = 1 - (ObjAnt.Cx**2 + ObjAnt.Cy**2).ravel()
+    domega = numpy.where(cz2 > 0, 1/numpy.sqrt(numpy.abs(cz2)), 0).astype(patterns.dtype)
+
+    gram = numpy.dot(patterns*domega, patterns.T)
+    norm = numpy.sqrt(numpy.diag(gram))
+    return gram/numpy.outer(norm, norm)
+
+
+def patternIsolines(amp, x, y, levels=isoline_levels, patches=None):
+    """
+    patternIsolines extracts the isolines of a pattern map with marching squares, so that
+    they can be stored with the pattern and drawn (see drawIsolines) without running con-
+    tour again.
+
+    Each grid cell is classified by which of its corners are above the level; the crossing
+    points are linearly interpolated on the cell edges and saddle cells are resolved with
+    the cell mean. Cells with a NaN corner produce no segment.
+
+    Parameters
+    ----------
+    amp = A (ny,nx) array giving the normalized pattern (AmisrPattern layout; transpose a
+      JroPattern norpattern).
+    x = An array (nx) giving the x axis of AMP.
+    y = An array (ny) giving the y axis of AMP.
+    levels = An array giving the contour levels. Default is isoline_levels.
+    patches = A list of (amp, x, y) refined patches (see AmisrPattern.getZoom). Samples of
+      AMP lying more than one step inside a patch are ignored, the patch is contoured in-
+      stead.
+
+    Return
+    ------
+    isolines = A list, one item per level, of (nseg,2,2) arrays giving the segments [(x0,y0),
+      (x1,y1)] of that level.
+    """
+
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    amp = numpy.array(amp, dtype=float)
+
+    if patches:
+        dx = x[1] - x[0]
+        dy = y[1] - y[0]
+        for pamp, px, py in patches:
+            inx = (x > px[0] + dx) & (x < px[-1] - dx)
+            iny = (y > py[0] + dy) & (y < py[-1] - dy)
+            amp[numpy.ix_(iny, inx)] = numpy.nan
+
+    z0 = amp[:-1,:-1]; z1 = amp[:-1,1:]; z2 = amp[1:,1:]; z3 = amp[1:,:-1]
+    valid = numpy.isfinite(z0) & numpy.isfinite(z1) & numpy.isfinite(z2) & numpy.isfinite(z3)
+    xl = x[None,:-1]; xr = x[None,1:]
+    yb = y[:-1,None]; yt = y[1:,None]
+
+    isolines = []
+    for level in levels:
+        b0 = z0 >= level; b1 = z1 >= level; b2 = z2 >= level; b3 = z3 >= level
+        cross = [(b0 != b1) & valid, (b1 != b2) & valid, (b3 != b2) & valid, (b0 != b3) & valid]
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t0 = (level - z0)/(z1 - z0)
+            t1 = (level - z1)/(z2 - z1)
+            t2 = (level - z3)/(z2 - z3)
+            t3 = (level - z0)/(z3 - z0)
+            # Crossing point on the bottom, right, top and left edge of every cell (only
+            # used where the edge is crossed, t is not finite elsewhere).
+            points = [(xl + t0*(xr - xl), yb + 0*t0), (xr + 0*t1, yb + t1*(yt - yb)),
+                      (xl + t2*(xr - xl), yt + 0*t2), (xl + 0*t3, yb + t3*(yt - yb))]
+
+        saddle = cross[0] & cross[1] & cross[2] & cross[3]
+        centre = (z0 + z1 + z2 + z3)/4 >= level
+        pairs = [((ea, eb), cross[ea] & cross[eb] & ~saddle)
+                 for ea, eb in [(0,1),(0,2),(0,3),(1,2),(1,3),(2,3)]]
+        # Saddles: cut around the two corners that the cell mean does not connect.
+        high = saddle & b0
+        pairs += [((0,1), high & centre), ((2,3), high & centre),
+                  ((0,3), high & ~centre), ((1,2), high & ~centre),
+                  ((0,3), saddle & ~b0 & centre), ((1,2), saddle & ~b0 & centre),
+                  ((0,1), saddle & ~b0 & ~centre), ((2,3), saddle & ~b0 & ~centre)]
+
+        segments = []
+        for (ea, eb), cells in pairs:
+            if not cells.any():
+                continue
+            pa = numpy.stack([points[ea][0][cells], points[ea][1][cells]], axis=-1)
+            pb = numpy.stack([points[eb][0][cells], points[eb][1][cells]], axis=-1)
+            segments.append(numpy.stack([pa, pb], axis=1))
+        isolines.append(numpy.concatenate(segments) if segments else numpy.zeros((0,2,2)))
+
+    for pamp, px, py in (patches or []):
+        for ilevel, psegments in enumerate(patternIsolines(pamp, px, py, levels=levels)):
+            isolines[ilevel] = numpy.concatenate([isolines[ilevel], psegments])
+
+    return isolines
+
+
+def drawIsolines(ax, isolines, levels=isoline_levels, colors=isoline_colors, fontsize=10):
+    """
+    drawIsolines draws isolines from patternIsolines as line collections, one per level.
+    Each level is labelled in dB once, at its outermost point along a direction that turns
+    45 degrees from level to level so that labels of nested rings do not overlap.
+    """
+
+    from matplotlib.collections import LineCollection
+
+    for ilevel, (level, segments, color) in enumerate(zip(levels, isolines, colors)):
+        if len(segments) == 0 or not numpy.any(segments[:,0] != segments[:,1]):
+            continue
+        ax.add_collection(LineCollection(segments, colors=[color], linewidths=1.5))
+        mid = segments.mean(axis=1)
+        angle = ilevel*numpy.pi/4
+        xl, yl = mid[numpy.argmax(mid[:,0]*numpy.cos(angle) + mid[:,1]*numpy.sin(angle))]
+        ax.text(xl, yl, str(int(numpy.round(10*numpy.log10(level)))), color=color,
+                fontsize=fontsize, ha='center', va='center',
+                bbox=dict(facecolor='white', edgecolor='none', pad=0.5))
+
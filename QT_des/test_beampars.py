@@ -0,0 +1,51 @@
+"""
+Tests of the default main-beam fit (gaussfit.quadfit) of AmisrPattern and JroPattern against the
+least-squares fit (exact=True): meanpos within 1e-5 and width within 1e-4 (relative), as docu-
+mented for a single, gaussian-shaped lobe above half power.
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import numpy
+import pytest
+from scipy import ndimage
+
+from plots import AmisrPattern, JroPattern
+from Pattern_Registry import registry
+
+# Predefined JRO patterns whose single main lobe is not gaussian (flat-topped or skewed): the two
+# fits estimate different gaussians there.
+nongaussian = (146, 322, 325)
+
+
+def _compare(default, exact):
+    assert numpy.max(numpy.abs(numpy.asarray(default.meanpos, dtype=float) -
+                               numpy.asarray(exact.meanpos, dtype=float))) < 1e-5
+    assert numpy.max(numpy.abs(numpy.asarray(default.beamwidth, dtype=float) /
+                               numpy.asarray(exact.beamwidth, dtype=float) - 1)) < 1e-4
+
+
+@pytest.mark.parametrize('azimuth, elevation', [(0, 90), (90, 80), (-60, 82), (180, 85),
+                                                (45, 88)])
+def test_amisr_quadfit_matches_exact(azimuth, elevation):
+    default = AmisrPattern(azimuth, elevation, maxphi=33)
+    exact = AmisrPattern(azimuth, elevation, maxphi=33, exact=True)
+    _compare(default, exact)
+
+
+def test_jro_quadfit_matches_exact():
+    checked = 0
+    for pattern_id in registry.ids():
+        if pattern_id in nongaussian:
+            continue
+        setup = registry.get(pattern_id)
+        kwargs = dict(pattern=0, maxphi=5, ues=setup['ues'], phases=setup['phase'],
+                      gain_tx=setup['gaintx'], gain_rx=setup['gainrx'], just_rx=setup['justrx'])
+        default = JroPattern(**kwargs)
+        # Split main beams (several lobes above half power) are outside the documented case.
+        if ndimage.label(numpy.nan_to_num(default.norpattern) > 0.5)[1] != 1:
+            continue
+        exact = JroPattern(exact=True, **kwargs)
+        _compare(default, exact)
+        checked += 1
+    assert checked > 0.9*len(registry.ids())
@@ -0,0 +1,58 @@
+"""
+Tests of the chirp-z array factor of AmisrPattern (fftopt=1) against the direct sum (fftopt=0).
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import numpy
+import pytest
+
+from plots import AmisrPattern, amisr_panelpos
+
+
+def _patterns(azimuth, elevation, xy_panelPos=[], wgts=[], **kwargs):
+    patterns = []
+    for fftopt in (0, 1):
+        ObjAnt = AmisrPattern(azimuth, elevation, maxphi=33, fftopt=fftopt, **kwargs)
+        ObjAnt.getPattern(xy_panelPos=xy_panelPos, wgts=wgts)
+        patterns.append(ObjAnt)
+    return patterns
+
+
+def _lattice(n=40, step=0.5):
+    m = (numpy.arange(n) - (n - 1)/2.)*step
+    x, y = numpy.meshgrid(m, m)
+    return numpy.array([x.ravel(), y.ravel()])
+
+
+@pytest.mark.parametrize('azimuth, elevation', [(0, 90), (30, 70), (-120, 55)])
+@pytest.mark.parametrize('npts', [101, 160])
+def test_czt_default_array_complex_weights(azimuth, elevation, npts):
+    rng = numpy.random.RandomState(11)
+    npanels = amisr_panelpos.shape[1]
+    wgts = rng.uniform(0.5, 1, npanels)*numpy.exp(1j*rng.uniform(-numpy.pi, numpy.pi, npanels))
+    direct, czt = _patterns(azimuth, elevation, wgts=wgts, nptsx=npts, nptsy=npts)
+
+    u = czt.dcosx - czt.Cx0
+    v = czt.dcosy - czt.Cy0
+    assert czt._AmisrPattern__cztArrayFactor(amisr_panelpos[0], amisr_panelpos[1], wgts, u, v) \
+        is not None
+    assert numpy.allclose(czt.norpattern, direct.norpattern, rtol=0, atol=1e-9)
+    assert numpy.allclose(czt.meanpos, direct.meanpos, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('azimuth, elevation', [(0, 90), (90, 80), (-60, 82)])
+def test_czt_lattice(azimuth, elevation):
+    xy_panelPos = _lattice()
+    rng = numpy.random.RandomState(7)
+    wgts = numpy.exp(1j*rng.uniform(-numpy.pi, numpy.pi, xy_panelPos.shape[1]))
+    direct, czt = _patterns(azimuth, elevation, xy_panelPos=xy_panelPos, wgts=wgts)
+
+    # The lattice must go through the chirp-z path, not the direct-sum fallback.
+    u = czt.dcosx - czt.Cx0
+    v = czt.dcosy - czt.Cy0
+    assert czt._AmisrPattern__cztArrayFactor(xy_panelPos[0], xy_panelPos[1], wgts, u, v) \
+        is not None
+
+    assert numpy.allclose(czt.norpattern, direct.norpattern, rtol=0, atol=1e-9)
+    assert numpy.allclose(czt.meanpos, direct.meanpos, rtol=0, atol=1e-9)
@@ -0,0 +1,29 @@
+"""
+Tests of the FFT method of JroPattern (fftopt=1) against the array method (fftopt=0).
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import numpy
+import pytest
+
+from plots import JroPattern
+from Pattern_Registry import registry
+
+
+def _setup(pattern_id):
+    setup = registry.get(pattern_id)
+    return dict(ues=setup['ues'], phases=setup['phase'], gain_tx=setup['gaintx'],
+                gain_rx=setup['gainrx'], just_rx=setup['justrx'])
+
+
+@pytest.mark.parametrize('pattern_id', [5, 8, 20])
+def test_fft_meanpos_matches_array(pattern_id):
+    # Steered beams: a transposed or mirrored FFT output swaps or flips meanpos. The methods
+    # model the modules differently (filled cells vs points), so only ~1e-3 is expected.
+    array = JroPattern(pattern=0, fftopt=0, maxphi=5, **_setup(pattern_id))
+    fft = JroPattern(pattern=0, fftopt=1, maxphi=5, **_setup(pattern_id))
+
+    assert numpy.all(numpy.sign(fft.meanpos) == numpy.sign(array.meanpos))
+    assert numpy.allclose(fft.meanpos, array.meanpos, atol=2e-3)
+    assert fft.norpattern.shape == array.norpattern.shape
@@ -0,0 +1,63 @@
+"""
+Tests of the module pattern of JroPattern (__modPattern, a matrix product) against the reference
+per-direction double loop it replaced.
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import numpy
+import pytest
+
+import Misc_Routines
+from plots import JroPattern, attenuation
+from Pattern_Registry import registry
+
+
+def referenceModPattern(ObjAnt, phase, gain):
+    """
+    referenceModPattern returns the module pattern of OBJANT summed direction by direction:
+
+    A1(ix,iy) = TOTAL(gain*EXP(COMPLEX(0,k*(posx*dcosx[ix] + posy*dcosy[iy]) + phase)))
+    """
+
+    pos = ObjAnt.eomwl*attenuation
+    posx = pos[0,:,:]
+    posy = pos[1,:,:]
+
+    phase = phase*Misc_Routines.CoFactors.d2r
+    module = numpy.zeros((ObjAnt.nx, ObjAnt.ny), dtype=complex)
+    for iy in range(ObjAnt.ny):
+        for ix in range(ObjAnt.nx):
+            yindex = iy*(ObjAnt.getcut==0) + ix*(ObjAnt.getcut==1)
+            phasex = posx*ObjAnt.dcosx[ix]
+            phasey = posy*ObjAnt.dcosy[yindex]
+            module[ix,iy] = numpy.sum(gain*numpy.exp(1j*(ObjAnt.kk*(phasex + phasey) + phase)))
+    return module
+
+
+def _steeredPhase(ObjAnt, setup):
+    # Phases as given to __modPattern by __usingArray: quarter offsets (ues) added, negated.
+    phase = numpy.array(setup['phase'], dtype=float)*360./ObjAnt.airwl
+    ues = numpy.asarray(setup['ues'], dtype=float)*360./ObjAnt.airwl
+    for ii, (xi, yi, xf, yf) in enumerate([(4,0,8,4), (0,0,4,4), (0,4,4,8), (4,4,8,8)]):
+        phase[xi:xf,yi:yf] += ues[ii]
+    return -phase
+
+
+@pytest.mark.parametrize('pattern_id', [1, 2, 5, 8, 20])
+@pytest.mark.parametrize('getcut', [0, 1])
+def test_modpattern_matches_reference(pattern_id, getcut):
+    setup = registry.get(pattern_id)
+    # Different nx and ny catch a transposed map; a cut (getcut=1) samples (dcosx, dcosy[:nx]).
+    nptsy = 21 if getcut==0 else 31
+    ObjAnt = JroPattern(pattern=0, maxphi=5, nptsx=31, nptsy=nptsy, getcut=getcut, ues=setup['ues'],
+                        phases=setup['phase'], gain_tx=setup['gaintx'], gain_rx=setup['gainrx'],
+                        just_rx=setup['justrx'])
+    phase = _steeredPhase(ObjAnt, setup)
+    gain = numpy.array(setup['gaintx'], dtype=float)
+
+    module = ObjAnt._JroPattern__modPattern(phase, gain)
+    reference = referenceModPattern(ObjAnt, phase, gain)
+
+    assert module.shape == reference.shape
+    assert numpy.allclose(module, reference, rtol=1e-9, atol=1e-9*numpy.abs(reference).max())
@@ -0,0 +1,49 @@
+"""
+Tests of PatternCache served from a beam atlas, including the refined (zoom) patterns the GUI map
+asks for.
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import numpy
+import pytest
+
+from Beam_Atlas import buildAtlas, readBeamcodes, BeamAtlas
+from Pattern_Cache import PatternCache
+
+
+@pytest.fixture(scope='module')
+def atlas(tmp_path_factory):
+    # Every 100th beamcode plus beams whose main lobe falls between coarse samples.
+    pointings = readBeamcodes('UMET_beamcodes.csv')
+    rows = set(range(0, pointings.shape[0], 100))
+    for azimuth, elevation in [(-29.92, 60.1), (33.5, 69.39)]:
+        rows |= set(numpy.nonzero((pointings[:,1] == azimuth) & (pointings[:,2] == elevation))[0])
+
+    path = tmp_path_factory.mktemp('atlas')
+    beamfile = str(path/'beamcodes.csv')
+    with open(beamfile, 'w') as fp:
+        fp.write('#Code,Azimuth,Elevation,Calibration\n')
+        for code, azimuth, elevation, calibration in pointings[sorted(rows)]:
+            fp.write('%d,%s,%s,%d\n' % (code, azimuth, elevation, calibration))
+
+    filename = str(path/'atlas.npy')
+    buildAtlas(filename, beamfile=beamfile, maxphi=33, verbose=False)
+    return BeamAtlas(filename)
+
+
+def test_zoom_every_atlas_beam(atlas):
+    cache = PatternCache(maxsize=1, atlas=atlas)
+    for rec in atlas.index:
+        pattern = cache.get(rec['azimuth'], rec['elevation'], maxphi=33, zoom=True)
+        assert pattern.patches is not None and len(pattern.patches) > 0
+        assert numpy.all(numpy.isfinite(pattern.meanpos))
+    assert cache.misses == 0
+
+
+def test_zoom_atlas_matches_computed(atlas):
+    rec = atlas.index[len(atlas)//2]
+    served = PatternCache(atlas=atlas).get(rec['azimuth'], rec['elevation'], maxphi=33, zoom=True)
+    computed = PatternCache().get(rec['azimuth'], rec['elevation'], maxphi=33, zoom=True)
+    assert numpy.allclose(served.meanpos, computed.meanpos, atol=1e-5)
+    assert numpy.allclose(served.patches[0][0], computed.patches[0][0], atol=1e-3)
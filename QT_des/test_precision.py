@@ -0,0 +1,58 @@
+"""
+Tests of the single precision mode of AmisrPattern and JroPattern: norpattern and meanpos stay
+within 1e-5 of the double precision results, as documented.
+
+Run from QT_des:  python -m pytest -q
+"""
+
+import tracemalloc
+import numpy
+import pytest
+
+from plots import AmisrPattern, JroPattern, precision_dtypes
+from Pattern_Registry import registry
+
+
+def _compare(double, single):
+    assert single.norpattern.dtype == numpy.float32
+    assert double.norpattern.dtype == numpy.float64
+    assert numpy.nanmax(numpy.abs(single.norpattern - double.norpattern)) < 1e-5
+    assert numpy.max(numpy.abs(numpy.asarray(single.meanpos, dtype=float) -
+                               numpy.asarray(double.meanpos, dtype=float))) < 1e-5
+
+
+@pytest.mark.parametrize('azimuth, elevation', [(0, 90), (30, 70), (-120, 55)])
+def test_amisr_single_precision(azimuth, elevation):
+    double = AmisrPattern(azimuth, elevation, maxphi=33, precision='double')
+    single = AmisrPattern(azimuth, elevation, maxphi=33, precision='single')
+    _compare(double, single)
+
+
+@pytest.mark.parametrize('pattern_id', [1, 5, 8])
+@pytest.mark.parametrize('fftopt', [0, 1])
+def test_jro_single_precision(pattern_id, fftopt):
+    setup = registry.get(pattern_id)
+    kwargs = dict(pattern=0, maxphi=5, fftopt=fftopt, ues=setup['ues'], phases=setup['phase'],
+                  gain_tx=setup['gaintx'], gain_rx=setup['gainrx'], just_rx=setup['justrx'])
+    double = JroPattern(precision='double', **kwargs)
+    single = JroPattern(precision='single', **kwargs)
+    _compare(double, single)
+
+
+@pytest.mark.parametrize('fftopt', [0, 1])
+def test_jro_single_precision_memory(fftopt):
+    # The grid-sized products run in single precision: the peak memory is about halved.
+    setup = registry.get(8)
+    kwargs = dict(pattern=0, maxphi=5, nptsx=401, nptsy=401, fftopt=fftopt, ues=setup['ues'],
+                  phases=setup['phase'], gain_tx=setup['gaintx'], gain_rx=setup['gainrx'],
+                  just_rx=setup['justrx'])
+    peaks = {}
+    for precision in ('double', 'single'):
+        tracemalloc.start()
+        try:
+            ObjAnt = JroPattern(precision=precision, **kwargs)
+            peaks[precision] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert ObjAnt.pattern.dtype == precision_dtypes[precision][0]
+    assert peaks['single'] < 0.6*peaks['double']